@@ -1,89 +1,201 @@
 # # data/log_parsers/EVTX/log_parsers_evtx.py
 
+import os
 import re
-from datetime import datetime
+import functools
+import threading
 import logging
+import multiprocessing
+from datetime import datetime
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import lxml.etree as ET  # using lxml for XML parsing
 import json
 
+import numpy as np
+
+try:
+    import orjson  # C/SIMD JSON encoder, much faster than json.dumps on EventData
+except ImportError:
+    orjson = None
+
 from evtx import PyEvtxParser  # pylint: disable=no-name-in-module # type: ignore # Rust-based parser
 
 logger = logging.getLogger("LogParsersEVTX") #pylint: disable=no-member
 logger.setLevel(logging.DEBUG) #pylint: disable=no-member
 
-def parse_evtx_log(filepath):
+# Pre-compiled XPath evaluators (run in libxml2 instead of ElementPath)
+EVT_NS = "http://schemas.microsoft.com/win/2004/08/events/event"
+_NSMAP = {"e": EVT_NS}
+_XP_SYSTEM = ET.XPath("e:System", namespaces=_NSMAP)
+_XP_DATA = ET.XPath("e:EventData/e:Data", namespaces=_NSMAP)
+
+# <System> children are read in a single pass, dispatching on the qualified tag:
+# tag -> (event field, attribute to read or None for the element text)
+_SYSTEM_FIELDS = {
+    f"{{{EVT_NS}}}EventID": ("EventID", None),
+    f"{{{EVT_NS}}}EventRecordID": ("RecordNumber", None),
+    f"{{{EVT_NS}}}TimeCreated": ("timestamp", "SystemTime"),
+    f"{{{EVT_NS}}}Provider": ("ProviderName", "Name"),
+    f"{{{EVT_NS}}}Level": ("Level", None),
+    f"{{{EVT_NS}}}Channel": ("Channel", None),
+    f"{{{EVT_NS}}}Computer": ("Computer", None),
+}
+
+# SystemTime is always "YYYY-MM-DDTHH:MM:SS.fffffffZ"; only milliseconds are kept.
+# The whole-second prefix is validated and converted once per distinct second.
+# Like the other parsers, the epoch is taken from the naive (local-time) datetime.
+_TS_SECONDS_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})')
+
+if orjson is not None:
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+else:
+    _json_dumps = json.dumps
+
+# Data @Name values are turned into identifier-safe keys; names repeat across
+# records of the same EventID, so the sanitized form is cached.
+_RE_NON_WORD = re.compile(r'\W+')
+
+@functools.lru_cache(maxsize=1024)
+def _data_key(name):
+    return _RE_NON_WORD.sub('_', name)
+
+# lxml parsers are not safe to share between threads, so keep one per worker thread
+_parser_local = threading.local()
+
+def _get_parser():
+    parser = getattr(_parser_local, "parser", None)
+    if parser is None:
+        parser = ET.XMLParser(encoding="utf-8", huge_tree=False, remove_blank_text=True)
+        _parser_local.parser = parser
+    return parser
+
+# Records are sent to worker processes in batches to amortize pickling/IPC cost
+EVTX_BATCH_SIZE = 1000
+
+# The pool is started from a Qt worker thread, so its processes are spawned
+# (forking a threaded process is unsafe), as on Windows
+_POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+# parse_evtx_records logs its progress every this many records
+EVTX_PROGRESS_INTERVAL = 10000
+
+def parse_evtx_records(records, keep_raw_xml=False, max_workers=None):
+    """
+    Generator over PyEvtxParser records: yields the parsed events of each batch of
+    EVTX_BATCH_SIZE records as a list, in file order (records that fail to parse
+    are left out).
+
+    The Rust reader produces XML faster than it can be post-processed, so batches
+    of records are parsed in a process pool of 'max_workers' processes. Events are
+    pickled back from the pool, so raw_xml is only included with keep_raw_xml=True.
+    """
+    workers = max_workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CONTEXT)
+    try:
+        # Bound the number of in-flight batches so the whole file is never queued at once.
+        max_pending = 2 * workers
+        pending = deque()
+        batch = []
+        for record_count, record in enumerate(records, start=1):
+            if record_count % EVTX_PROGRESS_INTERVAL == 0:
+                logger.info("Parsing record number: %d", record_count)
+            try:
+                batch.append(record["data"])
+            except Exception as e:
+                logger.warning(f"Failed to parse a record at record {record_count}: {e}")
+            if len(batch) >= EVTX_BATCH_SIZE:
+                pending.append(executor.submit(parse_evtx_record_xml_batch, batch, keep_raw_xml))
+                batch = []
+                if len(pending) >= max_pending:
+                    yield [event for event in pending.popleft().result() if event]
+        if batch:
+            pending.append(executor.submit(parse_evtx_record_xml_batch, batch, keep_raw_xml))
+        while pending:
+            yield [event for event in pending.popleft().result() if event]
+    finally:
+        # A caller that stops early (canceled import) does not wait for queued batches
+        executor.shutdown(cancel_futures=True)
+
+def parse_evtx_log(filepath, max_workers=None):
+    """
+    Parses a whole .evtx file into one dict per record (parse_evtx_records).
+    Returns (rows, min_time, max_time).
+    """
     logger.info(f"Starting EVTX log parsing for file: {filepath}")
     rows = []
     min_time = None
     max_time = None
+    # Timestamps go into a flat float64 buffer; min/max are taken once at the end.
+    ts_values = array('d')
+    ts_append = ts_values.append
 
     try:
         parser = PyEvtxParser(filepath)
-        record_count = 0
-        for record in parser.records():
-            record_count += 1
-            if record_count % 1000 == 0:
-                logger.info(f"Parsing record number: {record_count}")
-            try:
-                xml = record["data"]
-                event = parse_evtx_record_xml(xml)
-                if event:
-                    rows.append(event)
-                    ts_epoch = event.get("timestamp_epoch")
-                    if ts_epoch:
-                        if (min_time is None) or (ts_epoch < min_time):
-                            min_time = ts_epoch
-                            logger.debug(f"Updated min_time to: {min_time}")
-                        if (max_time is None) or (ts_epoch > max_time):
-                            max_time = ts_epoch
-                            logger.debug(f"Updated max_time to: {max_time}")
-            except Exception as e:
-                logger.warning(f"Failed to parse a record at record {record_count}: {e}")
-        logger.info(f"Completed parsing EVTX file: {filepath}. Total records parsed: {record_count}")
+        for events in parse_evtx_records(parser.records(), keep_raw_xml=True, max_workers=max_workers):
+            rows.extend(events)
+            for event in events:
+                ts_epoch = event.get("timestamp_epoch")
+                if ts_epoch:
+                    ts_append(ts_epoch)
+        logger.info(f"Completed parsing EVTX file: {filepath}.")
     except Exception as e:
         logger.error(f"Error opening or parsing EVTX '{filepath}': {e}")
+    if ts_values:
+        ts_arr = np.frombuffer(ts_values, dtype=np.float64)
+        min_time = float(ts_arr.min())
+        max_time = float(ts_arr.max())
+        logger.debug(f"Time range: {min_time} - {max_time}")
     logger.info(f"Parsed {len(rows)} rows from EVTX log '{filepath}'.")
     return rows, min_time, max_time
 
-def parse_evtx_record_xml(xml_str):
+def parse_evtx_record_xml_batch(xml_strs, keep_raw_xml=False):
+    """Parses a batch of record XML strings; runs inside the worker processes."""
+    return [parse_evtx_record_xml(xml_str, keep_raw_xml) for xml_str in xml_strs]
+
+def parse_evtx_record_xml(xml_str, keep_raw_xml=True):
     try:
-        if not xml_str.lstrip().startswith("<?xml"):
-            xml_str = '<?xml version="1.0" encoding="utf-8"?>\n' + xml_str
-        root = ET.fromstring(xml_str.encode("utf-8")) # type: ignore
+        # The parser is fixed to UTF-8, so no <?xml prolog is needed
+        root = ET.fromstring(xml_str.encode("utf-8"), _get_parser()) # type: ignore
         event = {}
-        ns = "{http://schemas.microsoft.com/win/2004/08/events/event}"
-        
+
         # System section
-        system = root.find(ns + "System")
-        if system is not None:
-            event["EventID"] = system.findtext(ns + "EventID", "Unknown")
-            event["RecordNumber"] = system.findtext(ns + "EventRecordID", "")
-            time_elem = system.find(ns + "TimeCreated")
-            time_str = time_elem.get("SystemTime") if time_elem is not None else ""
+        systems = _XP_SYSTEM(root)
+        if systems:
+            system_values = {}
+            for child in systems[0]:
+                spec = _SYSTEM_FIELDS.get(child.tag)
+                if spec is None or spec[0] in system_values:
+                    continue
+                field, attr = spec
+                system_values[field] = (child.get(attr) if attr else child.text) or ""
+            event["EventID"] = system_values.get("EventID") or "Unknown"
+            event["RecordNumber"] = system_values.get("RecordNumber", "")
+            time_str = system_values.get("timestamp", "")
             event["timestamp_epoch"] = parse_timestamp(time_str)
             event["timestamp"] = time_str
-            provider_elem = system.find(ns + "Provider")
-            event["ProviderName"] = provider_elem.get("Name") if provider_elem is not None else "Unknown"
-            event["Level"] = system.findtext(ns + "Level", "Unknown")
-            event["Channel"] = system.findtext(ns + "Channel", "Unknown")
-            event["Computer"] = system.findtext(ns + "Computer", "Unknown")
+            event["ProviderName"] = system_values.get("ProviderName") or "Unknown"
+            event["Level"] = system_values.get("Level") or "Unknown"
+            event["Channel"] = system_values.get("Channel") or "Unknown"
+            event["Computer"] = system_values.get("Computer") or "Unknown"
         
         # EventData section – use the proper namespace for children
         event_data = {}
         data_texts = []
-        event_data_elem = root.find(ns + "EventData")
-        if event_data_elem is not None:
-            for data in event_data_elem.findall(ns + "Data"):
-                name = data.get("Name", "Unnamed")
-                value = " ".join(data.itertext()).strip()
-                key = re.sub(r'\W+', '_', name)
-                event_data[key] = value
-                if value:
-                    data_texts.append(value)
+        for data in _XP_DATA(root):
+            name = data.get("Name", "Unnamed")
+            value = " ".join(data.itertext()).strip()
+            key = _data_key(name)
+            event_data[key] = value
+            if value:
+                data_texts.append(value)
         # Save full JSON and display text
-        event["EventData"] = json.dumps(event_data)
+        event["EventData"] = _json_dumps(event_data)
         event["EventData_display"] = "\n".join(data_texts)
-        event["raw_xml"] = xml_str
+        if keep_raw_xml:
+            event["raw_xml"] = xml_str
         return event
     except ET.XMLSyntaxError as pe:
         logger.error(f"XML parsing error: {pe}")
@@ -93,17 +205,22 @@ def parse_evtx_record_xml(xml_str):
         return None
 
 def parse_timestamp(time_str):
-    if not time_str or len(time_str) < 23:
+    if not time_str or time_str[19:20] != ".":
+        return None
+    seconds = _systemtime_seconds(time_str[:19])
+    ms = time_str[20:23]
+    if seconds is None or len(ms) != 3 or not ms.isdigit():
+        return None
+    return seconds + int(ms) / 1000.0
+
+@functools.lru_cache(maxsize=4096)
+def _systemtime_seconds(prefix):
+    """Epoch seconds for a 'YYYY-MM-DDTHH:MM:SS' SystemTime prefix, or None."""
+    m = _TS_SECONDS_RE.fullmatch(prefix)
+    if not m:
         return None
     try:
-        return datetime(
-            int(time_str[0:4]),
-            int(time_str[5:7]),
-            int(time_str[8:10]),
-            int(time_str[11:13]),
-            int(time_str[14:16]),
-            int(time_str[17:19]),
-            int(time_str[20:23]) * 1000
-        ).timestamp()
+        y, mo, d, h, mi, sec = map(int, m.groups())
+        return datetime(y, mo, d, h, mi, sec).timestamp()
     except Exception:
         return None
@@ -1,14 +1,25 @@
 import os
 import re
+import mmap
 import logging
+import functools
+import multiprocessing
+from array import array
 from datetime import datetime
 from collections import defaultdict
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 from lxml import etree  # Needed for XML parsing
+import numpy as np
 
 # Import functions from your msg_parser module
 from data.log_parsers.GENERIC.msg_parser import (
-    parse_big_xml,         # used for full XML files
-    merge_transaction_info  # used within line-based logs
+    LogRow,                 # row type yielded by all generic parsers
+    parse_big_xml,          # used for full XML files
+    parse_single_xml,       # used for inline XML fragments
+    merge_transaction_info, # used within line-based logs
+    merge_transaction,      # combines one txid seen in several files
+    Transaction
 )
 # Import specialized prom parser
 from data.log_parsers.GENERIC.prom_parser import parse_prom_log
@@ -18,39 +29,93 @@ logger = logging.getLogger("GenericLogParser")
 ###############################################################################
 # Regex for line-based logs
 ###############################################################################
+# All three line shapes below are matched in a single pass through one
+# alternation; m.lastgroup names the branch that matched.
+#
 # Example bracket log:
 # [2025-01-03 14:18:32,399] [0x000018ec] [DEBUG] [LpeComm] - [<LogLine File= "LpeComm.cpp" Line= "93"><![CDATA[GetCommStatus: 1]]></LogLine>]
-RE_BRACKET_LINE = re.compile(
-    r'^\[(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2},\d{3})\]\s+\[0x[a-fA-F0-9]+\]\s+\[([A-Za-z]+)\]\s+\[(.*?)\]\s+-\s+\[(.*)\]$'
+PAT_BRACKET_LINE = (
+    r'^\[(?P<b_ts>\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2},\d{3})\]\s+\[0x[a-fA-F0-9]+\]\s+\[(?P<b_level>[A-Za-z]+)\]\s+\[(?P<b_src>.*?)\]\s+-\s+\[(?P<b_msg>.*)\]$'
+)
+# Example converter-style log (e.g. in lpeconverter.log):
+# 2025-01-29 02:14:53,261 DEBUG [0:8888:9999:1:723048509:1/29/2025 2:14:49 AM] [27] LPE                    PromSrvClient.Send                           - Before, PromSrv Process GetLoyaltySummary Message 
+PAT_CONVERTER_LINE = (
+    r'^(?P<c_ts>\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2},\d{3})\s+(?P<c_level>[A-Z]+)\s+\[(?P<c_field1>[^\]]+)\]\s+\[(?P<c_field2>[^\]]+)\]\s+(?P<c_src>\S+)\s+(?P<c_func>\S+)\s+-\s+(?P<c_msg>.*)$'
 )
 # Example ISO log:
 # 2025-02-11 18:24:51,061 - MainWindow - INFO - Opening Generic Log for Parsing: C:/Users/Pc/Downloads/File.log.1
-RE_ISO_LINE = re.compile(
-    r'^(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2},\d{3})\s*-\s*(.*?)\s*-\s*([A-Z]+)\s*-\s*(.*)$'
+PAT_ISO_LINE = (
+    r'^(?P<i_ts>\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2},\d{3})\s*-\s*(?P<i_src>.*?)\s*-\s*(?P<i_level>[A-Z]+)\s*-\s*(?P<i_msg>.*)$'
 )
-# New regex for converter-style log lines (e.g. in lpeconverter.log)
-# Example:
-# 2025-01-29 02:14:53,261 DEBUG [0:8888:9999:1:723048509:1/29/2025 2:14:49 AM] [27] LPE                    PromSrvClient.Send                           - Before, PromSrv Process GetLoyaltySummary Message 
-RE_CONVERTER_LINE = re.compile(
-    r'^(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2},\d{3})\s+([A-Z]+)\s+\[([^\]]+)\]\s+\[([^\]]+)\]\s+(\S+)\s+(\S+)\s+-\s+(.*)$'
+# Alternatives are tried in the same order the parser used to check them.
+RE_LOG_LINE = re.compile(
+    '(?P<bracket>' + PAT_BRACKET_LINE + ')'
+    '|(?P<converter>' + PAT_CONVERTER_LINE + ')'
+    '|(?P<iso>' + PAT_ISO_LINE + ')'
 )
+# Group names holding (timestamp, level, message) for each branch
+LINE_GROUPS = {
+    'bracket': ('b_ts', 'b_level', 'b_msg'),
+    'converter': ('c_ts', 'c_level', 'c_msg'),
+    'iso': ('i_ts', 'i_level', 'i_msg'),
+}
 
 # For ignoring LPE query lines
 RE_LPE_QUERY = re.compile(r'<LPE\s+Method="Query', re.IGNORECASE)
 RE_LPE_QUERY_RESPONSE = re.compile(r'<LPE\s+Method="Query\(Response\)', re.IGNORECASE)
 
+# For stripping <![CDATA[ ... ]]> wrappers from inline XML
+RE_CDATA = re.compile(r'<!\[CDATA\[(.*?)\]\]>', re.DOTALL)
+
+# Fixed shape of the line timestamps ('%Y-%m-%d %H:%M:%S,%f' with milliseconds)
+RE_LINE_DATETIME = re.compile(r'(\d{4})-(\d{2})-(\d{2})\s+(\d{2}):(\d{2}):(\d{2}),(\d{3})')
+
 ###############################################################################
 # Time parsing helper (for line-based logs)
 ###############################################################################
-def parse_datetime(dt_str, fmt='%Y-%m-%d %H:%M:%S,%f'):
-    """Convert bracket/ISO log line timestamps to datetime."""
+DEFAULT_DATETIME_FMT = '%Y-%m-%d %H:%M:%S,%f'
+
+def parse_datetime(dt_str, fmt=DEFAULT_DATETIME_FMT):
+    """
+    Convert bracket/ISO log line timestamps to a (datetime, epoch float) pair.
+    Returns (None, None) if the string cannot be parsed.
+    """
+    if fmt == DEFAULT_DATETIME_FMT:
+        return _parse_line_datetime(dt_str)
     try:
-        return datetime.strptime(dt_str, fmt)
+        dt = datetime.strptime(dt_str, fmt)
     except ValueError:
         try:
-            return datetime.strptime(dt_str, "%d/%m/%y %H:%M:%S.%f")
+            dt = datetime.strptime(dt_str, "%d/%m/%y %H:%M:%S.%f")
         except ValueError:
-            return None
+            return None, None
+    return dt, dt.timestamp()
+
+@functools.lru_cache(maxsize=65536)
+def _parse_line_datetime(dt_str):
+    """
+    Cached parser for the default line timestamp format. Many lines share the
+    same timestamp, and the regex + datetime() path avoids strptime on a miss.
+    The epoch is computed here once so cache hits skip datetime.timestamp() too.
+    """
+    dt = None
+    m = RE_LINE_DATETIME.fullmatch(dt_str)
+    if m:
+        y, mo, d, h, mi, s, ms = map(int, m.groups())
+        try:
+            dt = datetime(y, mo, d, h, mi, s, ms * 1000)
+        except ValueError:
+            pass
+    if dt is None:
+        for fmt in (DEFAULT_DATETIME_FMT, "%d/%m/%y %H:%M:%S.%f"):
+            try:
+                dt = datetime.strptime(dt_str, fmt)
+                break
+            except ValueError:
+                pass
+    if dt is None:
+        return None, None
+    return dt, dt.timestamp()
 
 ###############################################################################
 # Helper to process inline XML from a log message.
@@ -74,15 +139,30 @@ def process_inline_xml_from_line(message_fragment, file_iterator, transactions,
                 break
 
     # Remove any <![CDATA[ ... ]]> wrappers.
-    xml_fragment = re.sub(r'<!\[CDATA\[(.*?)\]\]>', r'\1', xml_fragment, flags=re.DOTALL).strip()
+    xml_fragment = RE_CDATA.sub(r'\1', xml_fragment).strip()
     try:
         subroot = etree.fromstring(xml_fragment.encode('utf-8', errors='replace'))
-        # Import parse_single_xml on demand.
-        from data.log_parsers.GENERIC.msg_parser import parse_single_xml
         parse_single_xml(subroot, transactions, source_file=source_file)
         logger.debug("Processed inline XML fragment from log lines.")
     except Exception as e:
-        logger.debug(f"Failed to process inline XML: {e}")
+        logger.debug("Failed to process inline XML: %s", e)
+
+###############################################################################
+# Line iterator over a memory-mapped file
+###############################################################################
+def iter_mmap_lines(f):
+    """
+    Yields the lines of the open binary file 'f' (without line terminators),
+    splitting on the memory-mapped buffer instead of going through buffered text IO.
+    """
+    try:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty files cannot be mapped.
+        return
+    with mm:
+        for raw in iter(mm.readline, b''):
+            yield raw.rstrip(b'\r\n').decode('utf-8', errors='replace')
 
 ###############################################################################
 # Main line-based log parser
@@ -95,98 +175,47 @@ def parse_line_based(filepath, transactions, source_file=None):
     Also, if a line has no timestamp but looks like XML, we inherit the previous timestamp.
     """
     last_ts = None
-    with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-        # Use the file object as an iterator to support multiline XML accumulation.
+    last_ts_epoch = None
+    with open(filepath, 'rb') as fh:
+        # Share one line iterator to support multiline XML accumulation.
+        f = iter_mmap_lines(fh)
         for line in f:
-            line = line.rstrip('\n')
 
             # Skip LPE <Query lines.
             if RE_LPE_QUERY.search(line) or RE_LPE_QUERY_RESPONSE.search(line):
                 continue
 
             dt_obj = None
+            ts_epoch = None
             level = None
             message_part = None
             contains_xml = False
 
-            # 1) Check if this is a bracket log line.
-            m_b = RE_BRACKET_LINE.match(line)
-            if m_b:
-                dt_str, lvl, src, message_part = m_b.groups()
-                dt_obj = parse_datetime(dt_str)
-                level = lvl
-                last_ts = dt_obj if dt_obj else last_ts
-                if message_part and ("<?xml" in message_part or message_part.strip().startswith("<")):
-                    contains_xml = True
-                merge_transaction_info(line, transactions)
-                process_inline_xml_from_line(message_part, f, transactions, source_file)
-                yield {
-                    'raw_line': line,
-                    'combined_ts': dt_obj.timestamp() if dt_obj else None,
-                    'log_level': level,
-                    'trans_ids': [],
-                    'source_file': source_file,
-                    'is_transaction': contains_xml
-                }
-                continue
-
-            # 2) Check if this is a converter-style log line.
-            m_c = RE_CONVERTER_LINE.match(line)
-            if m_c:
-                dt_str, lvl, field1, field2, src, func, message_part = m_c.groups()
-                dt_obj = parse_datetime(dt_str)
-                level = lvl
-                last_ts = dt_obj if dt_obj else last_ts
+            # 1) Bracket, converter-style or ISO log line.
+            m = RE_LOG_LINE.match(line)
+            if m:
+                dt_str, level, message_part = m.group(*LINE_GROUPS[m.lastgroup])
+                dt_obj, ts_epoch = parse_datetime(dt_str)
+                if dt_obj:
+                    last_ts, last_ts_epoch = dt_obj, ts_epoch
                 if message_part and ("<?xml" in message_part or message_part.strip().startswith("<")):
                     contains_xml = True
                 merge_transaction_info(line, transactions)
-                process_inline_xml_from_line(message_part, f, transactions, source_file)
-                yield {
-                    'raw_line': line,
-                    'combined_ts': dt_obj.timestamp() if dt_obj else None,
-                    'log_level': level,
-                    'trans_ids': [],
-                    'source_file': source_file,
-                    'is_transaction': contains_xml
-                }
+                if contains_xml:
+                    process_inline_xml_from_line(message_part, f, transactions, source_file)
+                yield LogRow(line, ts_epoch, level, [], source_file, contains_xml)
                 continue
 
-            # 3) Check if this is an ISO log line.
-            m_i = RE_ISO_LINE.match(line)
-            if m_i:
-                dt_str, src, lvl, message_part = m_i.groups()
-                dt_obj = parse_datetime(dt_str)
-                level = lvl
-                last_ts = dt_obj if dt_obj else last_ts
-                if message_part and ("<?xml" in message_part or message_part.strip().startswith("<")):
-                    contains_xml = True
-                merge_transaction_info(line, transactions)
-                process_inline_xml_from_line(message_part, f, transactions, source_file)
-                yield {
-                    'raw_line': line,
-                    'combined_ts': dt_obj.timestamp() if dt_obj else None,
-                    'log_level': level,
-                    'trans_ids': [],
-                    'source_file': source_file,
-                    'is_transaction': contains_xml
-                }
-                continue
-
-            # 4) Fallback: plain line.
+            # 2) Fallback: plain line.
             merge_transaction_info(line, transactions)
             # If the line looks like XML and we have a previous timestamp, inherit it.
             if line.lstrip().startswith("<") and last_ts:
-                dt_obj = last_ts
+                dt_obj, ts_epoch = last_ts, last_ts_epoch
                 contains_xml = True
-            process_inline_xml_from_line(line, f, transactions, source_file)
-            yield {
-                'raw_line': line,
-                'combined_ts': dt_obj.timestamp() if dt_obj else None,
-                'log_level': None,
-                'trans_ids': [],
-                'source_file': source_file,
-                'is_transaction': contains_xml
-            }
+            # Only lines with a '<' can hold inline XML.
+            if '<' in line:
+                process_inline_xml_from_line(line, f, transactions, source_file)
+            yield LogRow(line, ts_epoch, None, [], source_file, contains_xml)
 
 ###############################################################################
 # Parse single file (auto-detect line-based vs. XML)
@@ -214,14 +243,7 @@ def parse_generic_log(filepath, source_file=None):
         for txid, tx_data in transactions.items():
             ts = tx_data.get('transaction_time')
             ts_float = ts.timestamp() if ts is not None else None
-            row_iter.append({
-                'raw_line': f"[PROMFILE] TX={txid}",
-                'combined_ts': ts_float,
-                'log_level': None,
-                'trans_ids': [txid],
-                'source_file': source_file,
-                'is_transaction': True
-            })
+            row_iter.append(LogRow(f"[PROMFILE] TX={txid}", ts_float, None, [txid], source_file, True))
     else:
         with open(filepath, 'r', encoding='utf-8', errors='replace') as ftest:
             first_chunk = ftest.read(2048)
@@ -232,46 +254,67 @@ def parse_generic_log(filepath, source_file=None):
         else:
             row_iter = parse_line_based(filepath, transactions, source_file=source_file)
 
-    # Collect rows and compute overall min and max timestamps.
+    # Collect rows; overall min and max timestamps are computed in one pass at the end.
+    ts_values = array('d')
     for row in row_iter:
         all_rows.append(row)
-        ts = row.get('combined_ts')
+        ts = row.combined_ts
         if ts is not None:
-            if min_dt is None or ts < min_dt:
-                min_dt = ts
-            if max_dt is None or ts > max_dt:
-                max_dt = ts
+            ts_values.append(ts)
+    if ts_values:
+        ts_arr = np.frombuffer(ts_values, dtype=np.float64)
+        min_dt = float(ts_arr.min())
+        max_dt = float(ts_arr.max())
 
     return all_rows, min_dt, max_dt, transactions
 
 ###############################################################################
 # Parse multiple logs and combine
 ###############################################################################
-def parse_multiple_logs(file_list):
+# Pool processes are spawned, never forked: parse_multiple_logs runs on a Qt
+# worker thread, and a forked child could inherit locks held by other threads.
+# Spawning also matches the Windows / frozen build on every platform.
+_POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+def _parse_generic_log_with_source(fpath):
+    """Process-pool entry point: parse one file, tagging rows with its base name."""
+    return parse_generic_log(fpath, source_file=os.path.basename(fpath))
+
+def parse_multiple_logs(file_list, max_workers=None):
     """
     Parse multiple files, combining their raw log rows and aggregated transaction data.
+    Files are independent, so with more than one file they are parsed in a process
+    pool of up to 'max_workers' processes; results are merged in file_list order
+    as they arrive (while later files are still being parsed), and a transaction
+    found in several (non-prom) files is merged into one record.
     """
     all_combined_rows = []
     global_transactions = {}
     global_min = None
     global_max = None
 
-    for fpath in file_list:
-        these_rows, min_dt, max_dt, these_trans = parse_generic_log(
-            fpath, source_file=os.path.basename(fpath)
-        )
-        all_combined_rows.extend(these_rows)
-        for txid, tdata in these_trans.items():
-            if txid not in global_transactions:
-                global_transactions[txid] = tdata
-            else:
-                # Optionally merge additional details here.
-                pass
-        if min_dt is not None:
-            if global_min is None or min_dt < global_min:
-                global_min = min_dt
-        if max_dt is not None:
-            if global_max is None or max_dt > global_max:
-                global_max = max_dt
+    workers = min(len(file_list), max_workers or os.cpu_count() or 1)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CONTEXT) if workers > 1 else nullcontext()
+    with pool as executor:
+        if executor is not None:
+            results = executor.map(_parse_generic_log_with_source, file_list)
+        else:
+            results = map(_parse_generic_log_with_source, file_list)
+
+        for these_rows, min_dt, max_dt, these_trans in results:
+            all_combined_rows.extend(these_rows)
+            for txid, tdata in these_trans.items():
+                existing = global_transactions.get(txid)
+                if existing is None:
+                    global_transactions[txid] = tdata
+                elif isinstance(existing, Transaction) and isinstance(tdata, Transaction):
+                    merge_transaction(existing, tdata)
+                # prom_parser records (PromTransaction) keep the first file's data.
+            if min_dt is not None:
+                if global_min is None or min_dt < global_min:
+                    global_min = min_dt
+            if max_dt is not None:
+                if global_max is None or max_dt > global_max:
+                    global_max = max_dt
 
     return all_combined_rows, global_min, global_max, global_transactions
@@ -2,36 +2,122 @@
 
 import re
 import codecs
+import functools
+from collections import namedtuple
+from dataclasses import dataclass
+from itertools import islice
+from sys import intern
+from typing import Optional
 from datetime import datetime
 from lxml import etree
 
+###############################################################################
+# Row type yielded by the generic parsers (one generic_logs record)
+###############################################################################
+LogRow = namedtuple(
+    "LogRow",
+    "raw_line combined_ts log_level trans_ids source_file is_transaction",
+    defaults=(False,)
+)
+
 ###############################################################################
 # Regex for capturing transaction data in raw text (used when merging info)
 ###############################################################################
 RE_TRANS_ID = re.compile(r'\b(?:TransID|TransactionNumber|TicketNumber)\s*=\s*"([^"]+)"', re.IGNORECASE)
-RE_CARD_ID  = re.compile(r'\bCardID\s*=\s*"([^"]+)"', re.IGNORECASE)
-RE_PHONE    = re.compile(r'\bName="(?:MobilePhoneNumber|HomePhone)"\s+Value="(\d+)"', re.IGNORECASE)
-RE_FIRST    = re.compile(r'\bFirstName\s*=\s*"([^"]+)"', re.IGNORECASE)
-RE_LAST     = re.compile(r'\bLastName\s*=\s*"([^"]+)"', re.IGNORECASE)
-RE_PROMO    = re.compile(r'\b(?:Promotion\s+ID|PromNumber|PromotionID)="?(\d+)"?', re.IGNORECASE)
-
-# For scanning <ItemInfo ...> in raw lines:
-RE_ITEM_BLOCK = re.compile(r'<ItemInfo\s+([^>]+)>', re.IGNORECASE)
+
+# For splitting the attributes of an <ItemInfo ...> block:
 RE_ATTR       = re.compile(r'(\w+)\s*=\s*"([^"]+)"')
+RE_LEADING_DIGITS = re.compile(r'\d+')
+# XML declarations inside an LPE payload (see _strip_xml_decl)
+RE_XML_DECL = re.compile(r'<\?xml\s+.*?\?>', re.DOTALL)
+
+# Attribute names (lower-cased local names) read by merge_transaction_info_elem
+_MERGE_ATTR_FIELDS = {
+    'transid': 'trans', 'transactionnumber': 'trans', 'ticketnumber': 'trans',
+    'cardid': 'card',
+    'firstname': 'first',
+    'lastname': 'last',
+    'promnumber': 'promo', 'promotionid': 'promo',
+    'name': 'name',
+    'value': 'value',
+}
+# Timestamp attribute suffixes (case-sensitive, as in RE_MERGE_ALL)
+_MERGE_TS_KINDS = ('StartDateTime', 'EndDateTime', 'BusinessDate')
+
+# Everything merge_transaction_info extracts, in one alternation so the text is
+# scanned once: trans ids, card, phones, names, promotions, <ItemInfo ...> blocks
+# and the inline StartDateTime/EndDateTime/BusinessDate timestamps.
+# The ItemInfo branch is a zero-width lookahead so attributes inside the block are
+# still matched by the other branches; timestamp attributes stay case-sensitive.
+RE_MERGE_ALL = re.compile(
+    r'\b(?:TransID|TransactionNumber|TicketNumber)\s*=\s*"(?P<trans>[^"]+)"'
+    r'|\bCardID\s*=\s*"(?P<card>[^"]+)"'
+    r'|\bName="(?:MobilePhoneNumber|HomePhone)"\s+Value="(?P<phone>\d+)"'
+    r'|\bFirstName\s*=\s*"(?P<first>[^"]+)"'
+    r'|\bLastName\s*=\s*"(?P<last>[^"]+)"'
+    r'|\b(?:Promotion\s+ID|PromNumber|PromotionID)="?(?P<promo>\d+)"?'
+    r'|(?=<ItemInfo\s+(?P<item>[^>]+)>)'
+    r'|(?-i:(?P<ts_kind>StartDateTime|EndDateTime|BusinessDate)="(?P<ts>[^"]+)")',
+    re.IGNORECASE
+)
+
+###############################################################################
+# Descendant lookups for the './/Tag' searches below. iterdescendants(tag) is
+# filtered in C and needs no path parsing; it is lazy, so single lookups stop
+# at the first match like element.find() does.
+###############################################################################
+_XP_PRICES_PRICE = etree.XPath('.//Prices/Price')
+
+def _intern(value):
+    """Interns repeated attribute values (store/cashier ids, PLU/department codes)."""
+    return intern(value) if value else value
+
+def _fnum(el, key, default=0.0):
+    """Numeric attribute 'key' of 'el' (element or attribute dict); 'default' if missing/empty."""
+    v = el.get(key)
+    return float(v) if v else default
+
+def _ftext(text, default):
+    """float(text), or 'default' if text is empty or not a number."""
+    if not text:
+        return default
+    try:
+        return float(text)
+    except ValueError:
+        return default
+
+def _first_descendant(element, tag):
+    """First descendant of 'element' with the given tag, or None."""
+    return next(element.iterdescendants(tag), None)
 
-# Inline XML timestamps (some known attributes)
-RE_START_DATETIME = re.compile(r'StartDateTime="([^"]+)"')
-RE_END_DATETIME   = re.compile(r'EndDateTime="([^"]+)"')
-RE_BUSINESS_DATE  = re.compile(r'BusinessDate="([^"]+)"')
+def _xp_first(xpath, element):
+    """First result of a compiled XPath, or None."""
+    result = xpath(element)
+    return result[0] if result else None
 
 ###############################################################################
 # Timestamp parser for XML fields
 ###############################################################################
+@functools.lru_cache(maxsize=16384)
 def parse_timestamp(ts_str):
     """
     Tries several common ISO or T‑separated timestamp formats.
     Supports both comma and dot as the fractional separator.
+    Results are cached: the same timestamp strings (e.g. BusinessDate) repeat
+    across a log, and datetime objects are immutable.
     """
+    # Fast path: datetime.fromisoformat, limited to exactly the shapes of the
+    # formats below (naive, 'T' + '.fff' or ' ' + ',fff', 1-6 fraction digits).
+    n = len(ts_str)
+    if (19 <= n <= 26 and n != 20 and ts_str[4] == '-' and ts_str[7] == '-'
+            and ts_str[13] == ':' and ts_str[16] == ':'):
+        sep = ts_str[10]
+        frac_sep = '.' if sep == 'T' else ','
+        if sep in ('T', ' ') and (n == 19 or (ts_str[19] == frac_sep and ts_str[20:].isdigit())):
+            try:
+                return datetime.fromisoformat(ts_str)
+            except ValueError:
+                pass
     for fmt in (
         '%Y-%m-%dT%H:%M:%S.%f',
         '%Y-%m-%dT%H:%M:%S',
@@ -47,32 +133,99 @@ def parse_timestamp(ts_str):
 ###############################################################################
 # Transaction initialization
 ###############################################################################
+@dataclass(slots=True)
+class Transaction:
+    """
+    Aggregated data of one transaction. Slotted, so the many records of a big
+    log carry no per-instance __dict__. get()/[] give consumers that also take
+    prom_parser's records (e.g. upsert_transaction) the same read access.
+
+    The set/list/dict fields stay None until something is stored in them (see
+    _add/_append/_update); many transactions only ever get a store or cashier.
+    """
+    trans_id: str
+    storeID: Optional[str] = None
+    cashierID: Optional[str] = None
+    card_id: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    phone_numbers: Optional[set] = None
+    promotions: Optional[set] = None
+    items: Optional[list] = None
+    documents: Optional[list] = None
+    tenders: Optional[list] = None
+    msg_type_counts: Optional[dict] = None
+    transaction_time: Optional[datetime] = None  # earliest found timestamp
+    explicit_total: Optional[float] = None
+    promo_items: Optional[list] = None
+    loyalty_info: Optional[dict] = None  # {'balances': [...], 'accounts': [...], 'members': [...]}
+    timestamps: Optional[set] = None  # store all discovered timestamps
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
 def init_transaction(txid, transactions):
     """Initialize a transaction record if it does not already exist."""
     if txid not in transactions:
-        transactions[txid] = {
-            'trans_id': txid,
-            'storeID': None,
-            'cashierID': None,
-            'card_id': None,
-            'first_name': None,
-            'last_name': None,
-            'phone_numbers': set(),
-            'promotions': set(),
-            'items': [],
-            'documents': [],
-            'tenders': [],
-            'msg_type_counts': {},
-            'transaction_time': None,  # earliest found timestamp
-            'explicit_total': None,
-            'promo_items': [],
-            'loyalty_info': {
-                'balances': [],
-                'accounts': [],
-                'members': []
-            },
-            'timestamps': set()  # store all discovered timestamps
-        }
+        transactions[txid] = Transaction(txid)
+
+def merge_transaction(rec, other):
+    """
+    Merges 'other' (the same txid parsed from another file) into 'rec': missing
+    scalar fields are filled in, sets are unioned and transaction_time stays the
+    earliest. Item/document/tender lists are only taken over when 'rec' has none,
+    so a transaction logged in two files does not count its items twice.
+    """
+    for name in ('storeID', 'cashierID', 'card_id', 'first_name', 'last_name', 'explicit_total'):
+        if getattr(rec, name) is None:
+            setattr(rec, name, getattr(other, name))
+    for name in ('phone_numbers', 'promotions'):
+        _update(rec, name, getattr(other, name))
+    for name in ('items', 'documents', 'tenders', 'promo_items', 'msg_type_counts', 'loyalty_info'):
+        if not getattr(rec, name):
+            setattr(rec, name, getattr(other, name))
+    for dt in other.timestamps or ():
+        _add_ts(rec, dt)
+
+def _add(rec, name, value):
+    """Adds 'value' to the set field 'name' of rec, creating the set on first use."""
+    s = getattr(rec, name)
+    if s is None:
+        setattr(rec, name, {value})
+    else:
+        s.add(value)
+
+def _update(rec, name, values):
+    """Adds all of 'values' to the set field 'name' of rec (nothing is allocated if empty)."""
+    if values:
+        s = getattr(rec, name)
+        if s is None:
+            setattr(rec, name, set(values))
+        else:
+            s.update(values)
+
+def _append(rec, name, value):
+    """Appends 'value' to the list field 'name' of rec, creating the list on first use."""
+    lst = getattr(rec, name)
+    if lst is None:
+        setattr(rec, name, [value])
+    else:
+        lst.append(value)
+
+def _add_ts(rec, dt):
+    """Adds 'dt' to rec.timestamps, keeping rec.transaction_time as the earliest."""
+    ts = rec.timestamps
+    if ts is None:
+        rec.timestamps = {dt}
+    else:
+        ts.add(dt)
+    cur = rec.transaction_time
+    if cur is None or dt < cur:
+        rec.transaction_time = dt
 
 ###############################################################################
 # Helper to merge from text (line-based or inline chunk)
@@ -82,95 +235,184 @@ def merge_transaction_info(text, transactions):
     Scans 'text' for known patterns (TransID, CardID, etc.) and merges data into `transactions`.
     Also extracts known inline timestamps from attributes like StartDateTime, EndDateTime, etc.
     """
-    trans_ids = RE_TRANS_ID.findall(text)
+    # Most lines carry no transaction; reject those with the cheap single pattern.
+    if not RE_TRANS_ID.search(text):
+        return
+
+    # --- Single pass over the text, dispatching on the matched branch ---
+    trans_ids = []
+    cards = []
+    firsts = []
+    lasts = []
+    phones = []
+    promos = []
+    item_blocks = []
+    ts_by_kind = {}
+    for m in RE_MERGE_ALL.finditer(text):
+        kind = m.lastgroup
+        if kind == 'trans':
+            trans_ids.append(m.group('trans'))
+        elif kind == 'card':
+            cards.append(m.group('card'))
+        elif kind == 'phone':
+            phones.append(m.group('phone'))
+        elif kind == 'first':
+            firsts.append(m.group('first'))
+        elif kind == 'last':
+            lasts.append(m.group('last'))
+        elif kind == 'promo':
+            promos.append(m.group('promo'))
+        elif kind == 'item':
+            item_blocks.append(dict(RE_ATTR.findall(m.group('item'))))
+        elif kind == 'ts':
+            # Only the first occurrence of each timestamp attribute is used.
+            ts_by_kind.setdefault(m.group('ts_kind'), m.group('ts'))
+    _merge_found(transactions, trans_ids, cards, firsts, lasts, phones, promos,
+                 item_blocks, ts_by_kind)
+
+def merge_transaction_info_elem(elem, transactions):
+    """
+    Element counterpart of merge_transaction_info() for already parsed XML: reads
+    the same fields from the attributes of 'elem' and its descendants in a single
+    iter() walk instead of serializing the subtree and regex-scanning the text.
+    """
+    trans_ids = []
+    cards = []
+    firsts = []
+    lasts = []
+    phones = []
+    promos = []
+    item_blocks = []
+    ts_by_kind = {}
+    for el in elem.iter():
+        attrib = el.attrib
+        if not attrib:
+            continue
+        name_attr = None
+        value_attr = None
+        for key, value in attrib.items():
+            local = key.rpartition('}')[2]
+            field = _MERGE_ATTR_FIELDS.get(local.lower())
+            if field is not None and value:
+                if field == 'trans':
+                    trans_ids.append(value)
+                elif field == 'card':
+                    cards.append(value)
+                elif field == 'first':
+                    firsts.append(value)
+                elif field == 'last':
+                    lasts.append(value)
+                elif field == 'promo':
+                    m = RE_LEADING_DIGITS.match(value)
+                    if m:
+                        promos.append(m.group())
+                elif field == 'name':
+                    name_attr = value
+                elif field == 'value':
+                    value_attr = value
+            if value and local.endswith(_MERGE_TS_KINDS):
+                for ts_kind in _MERGE_TS_KINDS:
+                    if local.endswith(ts_kind):
+                        ts_by_kind.setdefault(ts_kind, value)
+        if (name_attr and value_attr and value_attr.isdigit()
+                and name_attr.lower() in ('mobilephonenumber', 'homephone')):
+            phones.append(value_attr)
+        if isinstance(el.tag, str) and el.tag.rpartition('}')[2].lower() == 'iteminfo':
+            item_blocks.append({key.rpartition('}')[2]: value for key, value in attrib.items() if value})
+    _merge_found(transactions, trans_ids, cards, firsts, lasts, phones, promos,
+                 item_blocks, ts_by_kind)
+
+def _merge_found(transactions, trans_ids, cards, firsts, lasts, phones, promos,
+                 item_blocks, ts_by_kind):
+    """Merges the fields found by merge_transaction_info(_elem) into every transaction found."""
     if not trans_ids:
         return
 
+    timestamps = []
+    for ts_kind in ('StartDateTime', 'EndDateTime', 'BusinessDate'):
+        if ts_kind in ts_by_kind:
+            ts = parse_timestamp(ts_by_kind[ts_kind].strip())
+            if ts:
+                timestamps.append(ts)
+
     for txid in set(trans_ids):
         init_transaction(txid, transactions)
         rec = transactions[txid]
 
         # --- Basic attributes (card, names, phones, promotions) ---
-        for c in RE_CARD_ID.findall(text):
-            if not rec['card_id']:
-                rec['card_id'] = c
-        firsts = RE_FIRST.findall(text)
-        lasts  = RE_LAST.findall(text)
-        if firsts and not rec['first_name']:
-            rec['first_name'] = firsts[-1]
-        if lasts and not rec['last_name']:
-            rec['last_name'] = lasts[-1]
-        for p in RE_PHONE.findall(text):
-            rec['phone_numbers'].add(p)
-        for pm in RE_PROMO.findall(text):
-            rec['promotions'].add(pm)
+        if cards and not rec.card_id:
+            rec.card_id = cards[0]
+        if firsts and not rec.first_name:
+            rec.first_name = firsts[-1]
+        if lasts and not rec.last_name:
+            rec.last_name = lasts[-1]
+        _update(rec, 'phone_numbers', phones)
+        _update(rec, 'promotions', promos)
 
         # --- Items from <ItemInfo ...> blocks ---
-        for block_str in RE_ITEM_BLOCK.findall(text):
-            attrs = dict(RE_ATTR.findall(block_str))
-            rec['items'].append({
-                'plu': attrs.get('PluCode', ''),
+        for attrs in item_blocks:
+            _append(rec, 'items', {
+                'plu': _intern(attrs.get('PluCode', '')),
                 'name': attrs.get('Name', '').strip(),
-                'depCode': attrs.get('DepCode', ''),
-                'qty': float(attrs.get('Quantity', '1')),
-                'price': float(attrs.get('Price', '0')),
-                'amount': float(attrs.get('Amount', '0')),
+                'depCode': _intern(attrs.get('DepCode', '')),
+                'qty': _fnum(attrs, 'Quantity', 1.0),
+                'price': _fnum(attrs, 'Price'),
+                'amount': _fnum(attrs, 'Amount'),
             })
 
-        # --- Extract timestamps from certain attributes in the text ---
-        for regex in (RE_START_DATETIME, RE_END_DATETIME, RE_BUSINESS_DATE):
-            m = regex.search(text)
-            if m:
-                ts = parse_timestamp(m.group(1).strip())
-                if ts:
-                    rec['timestamps'].add(ts)
-
-        if rec['timestamps'] and rec['transaction_time'] is None:
-            rec['transaction_time'] = min(rec['timestamps'])
+        # --- Timestamps from certain attributes ---
+        for ts in timestamps:
+            _add_ts(rec, ts)
 
 ###############################################################################
-# Recursively scan for *any* date/time tags or attributes we care about
+# Scan a subtree for *any* date/time tags or attributes we care about
 ###############################################################################
+DATE_ATTRS = frozenset({
+    'StartDateTime', 'EndDateTime', 'BusinessDate', 'ServerDate',
+    'PeriodBusinessDate', 'MemberEffectiveDate', 'ExpirationDate',
+    'StartDate', 'EndDate'
+})
+
 def scan_for_timestamps(element, aggregator):
     """
-    Recursively scans 'element' and its children for known date/time 
-    attributes or tag names (e.g. StartDateTime, EndDateTime, BusinessDate, 
-    ExpirationDate, etc.) and adds them to aggregator['timestamps'].
+    Scans 'element' and all of its descendants (lxml's C-level iter(), no
+    Python recursion) for known date/time attributes or tag names
+    (e.g. StartDateTime, EndDateTime, BusinessDate, ExpirationDate, etc.)
+    and adds them to the aggregator via _add_ts.
     """
-    DATE_ATTRS = {
-        'StartDateTime', 'EndDateTime', 'BusinessDate', 'ServerDate',
-        'PeriodBusinessDate', 'MemberEffectiveDate', 'ExpirationDate',
-        'StartDate', 'EndDate'
-    }
-    # 1) Check element's attributes
-    for attr_name, attr_value in element.attrib.items():
-        if attr_name in DATE_ATTRS:
-            dt = parse_timestamp(attr_value)
-            if dt:
-                aggregator['timestamps'].add(dt)
-
-    # 2) Check element text if tag is one of our date/time fields
-    tag_name = element.tag
-    if tag_name in DATE_ATTRS and element.text:
-        dt = parse_timestamp(element.text.strip())
-        if dt:
-            aggregator['timestamps'].add(dt)
+    add = _add_ts
+    pt = parse_timestamp
+    for el in element.iter():
+        # 1) Check element's attributes
+        for attr_name, attr_value in el.items():
+            if attr_name in DATE_ATTRS:
+                dt = pt(attr_value)
+                if dt:
+                    add(aggregator, dt)
 
-    # 3) Recurse into children
-    for child in element:
-        scan_for_timestamps(child, aggregator)
+        # 2) Check element text if tag is one of our date/time fields
+        if el.tag in DATE_ATTRS and el.text:
+            dt = pt(el.text.strip())
+            if dt:
+                add(aggregator, dt)
 
 ###############################################################################
 # Loyalty-specific parsing
 ###############################################################################
-def parse_loyalty_balances(root, aggregator):
+def _loyalty_append(rec, key, entry):
+    """Appends 'entry' to rec.loyalty_info[key], creating loyalty_info on first use."""
+    info = rec.loyalty_info
+    if info is None:
+        info = rec.loyalty_info = {'balances': [], 'accounts': [], 'members': []}
+    info[key].append(entry)
+
+def parse_loyalty_balances(root, rec):
     """
-    Finds <Balance> or <Acc> elements to store in aggregator['balances'] or
-    aggregator['accounts'].
+    Finds <Balance> or <Acc> elements to store in rec.loyalty_info['balances'] or
+    rec.loyalty_info['accounts'].
     """
-    balances = root.findall('.//Balance')
-    for b in balances:
-        aggregator['balances'].append({
+    for b in root.iterdescendants('Balance'):
+        _loyalty_append(rec, 'balances', {
             'type': b.get('Type'),
             'balance_id': b.get('ID'),
             'name': b.get('Name'),
@@ -180,9 +422,8 @@ def parse_loyalty_balances(root, aggregator):
             'current_balance': b.get('CurrentBalance'),
         })
 
-    accs = root.findall('.//Acc')
-    for a in accs:
-        aggregator['accounts'].append({
+    for a in root.iterdescendants('Acc'):
+        _loyalty_append(rec, 'accounts', {
             'acc_id': a.get('ID'),
             'earn_value': a.get('EarnValue'),
             'open_balance': a.get('OpenBalance'),
@@ -190,31 +431,33 @@ def parse_loyalty_balances(root, aggregator):
             'value': a.get('Value'),
         })
 
-def parse_loyalty_members(root, aggregator):
+def parse_loyalty_members(root, rec):
     """
-    Finds <Member ...> elements to store in aggregator['members'].
+    Finds <Member ...> elements to store in rec.loyalty_info['members'].
     """
-    members = root.findall('.//Member')
-    for m in members:
+    for m in root.iterdescendants('Member'):
         mem_data = {
             'last_name': m.get('LastName'),
             'first_name': m.get('FirstName'),
             'status': m.get('Status'),
             'member_external_id': m.get('MemberExternalId'),
         }
-        aggregator['members'].append(mem_data)
+        _loyalty_append(rec, 'members', mem_data)
 
-def parse_loyalty_xml(fragment, aggregator):
+def parse_loyalty_xml(fragment, rec):
     """
     Higher-level function to parse loyalty elements in 'fragment' and
-    store them in aggregator['balances'], aggregator['accounts'], aggregator['members'].
+    store them in rec.loyalty_info['balances'], ['accounts'] and ['members'].
     """
-    parse_loyalty_balances(fragment, aggregator)
-    parse_loyalty_members(fragment, aggregator)
+    parse_loyalty_balances(fragment, rec)
+    parse_loyalty_members(fragment, rec)
 
 ###############################################################################
 # Main XML parser for a single root
 ###############################################################################
+def _is_customer(elem):
+    return elem.tag.endswith('Customer')
+
 def parse_single_xml(root, transactions, source_file=None):
     """
     Given an XML 'root', examine known sections (<Log><Session>, <biztalk_1>, <Customer>, etc.)
@@ -223,298 +466,359 @@ def parse_single_xml(root, transactions, source_file=None):
     to capture all data and timestamps.
     """
     # PART 1: Process <Session> if present
-    session = root.find('.//Session')
+    session = _first_descendant(root, 'Session')
     if session is not None:
-        current_ticket = None
-        for lpe in session.findall('LPE'):
-            method = lpe.get('Method')
-            xml_str = "".join(lpe.itertext()).strip()
-            xml_str = re.sub(r'<\?xml\s+.*?\?>', '', xml_str, flags=re.DOTALL).strip()
-            try:
-                subroot = etree.fromstring(xml_str.encode('utf-8', errors='replace'))
-            except Exception:
-                subroot = None
-            if method == 'SetParam' and subroot is not None:
-                sysparams = subroot.find('.//SystemParameters')
-                if sysparams is not None:
-                    current_ticket = sysparams.get('TicketNumber')
-                    store_id = sysparams.get('StoreID')
-                    cashier_id = sysparams.get('CashierID')
-                    if current_ticket:
-                        init_transaction(current_ticket, transactions)
-                        rec = transactions[current_ticket]
-                        rec['storeID'] = store_id
-                        rec['cashierID'] = cashier_id
-                        scan_for_timestamps(subroot, rec)
-                        if rec['transaction_time'] is None and rec['timestamps']:
-                            rec['transaction_time'] = min(rec['timestamps'])
-            elif method == 'AddItem' and subroot is not None and current_ticket:
-                rec = transactions[current_ticket]
-                item_info = subroot.find('.//ItemInfo')
-                if item_info is not None:
-                    plu = item_info.get('PluCode', '')
-                    nm  = item_info.get('Name', '').strip()
-                    dep = item_info.get('DepCode', '')
-                    amt_val = float(item_info.get('Amount','0') or 0)
-                    qty_val = float(item_info.get('Quantity','1') or 1)
-                    base_price = float(item_info.get('Price','0') or 0)
-                    prices_el = item_info.find('.//Prices/Price')
-                    subprice_val = float(prices_el.get('Price','0')) if prices_el is not None else base_price
-                    rec['items'].append({
-                        'plu': plu,
-                        'name': nm,
-                        'depCode': dep,
-                        'qty': qty_val,
-                        'price': subprice_val,
-                        'amount': amt_val,
-                    })
-                scan_for_timestamps(subroot, rec)
-                if rec['transaction_time'] is None and rec['timestamps']:
-                    rec['transaction_time'] = min(rec['timestamps'])
-            elif method in ('AddTender','AddDocument','AddDocument(Response)') and subroot is not None and current_ticket:
-                rec = transactions[current_ticket]
-                if method == 'AddTender':
-                    tend_el = subroot.find('.//TenderInfo')
-                    if tend_el is not None:
-                        amt = float(tend_el.get('Amount','0') or 0)
-                        rec['tenders'].append({
-                            'tenderNo': tend_el.get('TenderNo'),
-                            'amount': amt,
-                            'tenderType': tend_el.get('TenderType') or ''
-                        })
-                else:
-                    docinfo = subroot.find('.//DocumentInfo')
-                    if docinfo is not None:
-                        for d in docinfo.findall('Document'):
-                            rec['documents'].append({
-                                'documentType': d.get('DocumentType'),
-                                'barcode': d.get('Barcode'),
-                                'confirmationLevel': d.get('ConfirmationLevel'),
-                                'promotionId': d.get('PromotionId'),
-                                'description': d.get('PromotionDescription')
-                            })
-                scan_for_timestamps(subroot, rec)
-                if rec['transaction_time'] is None and rec['timestamps']:
-                    rec['transaction_time'] = min(rec['timestamps'])
-            elif method == 'GetTriggeredPromotions' and subroot is not None and current_ticket:
-                rec = transactions[current_ticket]
-                for dl in subroot.findall('.//DiscountLine'):
-                    pn = dl.get('PromNumber')
-                    if pn:
-                        rec['promotions'].add(pn)
-                scan_for_timestamps(subroot, rec)
-                if rec['transaction_time'] is None and rec['timestamps']:
-                    rec['transaction_time'] = min(rec['timestamps'])
-            elif method == 'Query(Response)' and subroot is not None:
-                titems_node = subroot.find('.//TicketItems')
-                if titems_node is not None:
-                    if not current_ticket:
-                        gdata = subroot.find('.//GeneralData')
-                        if gdata is not None:
-                            tnum = gdata.get('TicketNumber')
-                            if tnum:
-                                current_ticket = tnum
-                                init_transaction(tnum, transactions)
-                    if current_ticket:
-                        rec = transactions[current_ticket]
-                        for iel in titems_node.findall('Item'):
-                            pl   = iel.get('PluCode','')
-                            dep  = iel.get('DepCode','')
-                            qty  = float(iel.get('Quantity','1') or 1)
-                            price= float(iel.get('Price','0') or 0)
-                            rew  = float(iel.get('RewardAmount','0') or 0)
-                            if rew == 0:
-                                rew = price*qty
-                            rec['items'].append({
-                                'plu': pl,
-                                'name': '',
-                                'depCode': dep,
-                                'qty': qty,
-                                'price': price,
-                                'amount': rew
-                            })
-                        parse_loyalty_xml(subroot, rec['loyalty_info'])
-                        scan_for_timestamps(subroot, rec)
-                        if rec['transaction_time'] is None and rec['timestamps']:
-                            rec['transaction_time'] = min(rec['timestamps'])
-            merge_transaction_info(xml_str, transactions)
-
-    # --------------------------------------------------------------------------
+        parse_session_xml(session, transactions)
+
     # PART 2: <biztalk_1> branch
-    # --------------------------------------------------------------------------
-    biztalk = root.find('.//biztalk_1')
+    biztalk = _first_descendant(root, 'biztalk_1')
     if biztalk is not None:
-        body = biztalk.find('body')
-        if body is not None:
-            ast = body.find('ActiveStore_SalesTransaction_1.70')
-            if ast is not None:
-                tx_number  = ast.findtext('TransactionNumber')
-                store_id   = ast.findtext('StoreID')
-                cashier_id = ast.findtext('CashierID')
-                if tx_number:
-                    init_transaction(tx_number, transactions)
-                    rec = transactions[tx_number]
-                    rec['storeID'] = store_id
-                    rec['cashierID'] = cashier_id
-                    scan_for_timestamps(ast, rec)
-                    if rec['transaction_time'] is None and rec['timestamps']:
-                        rec['transaction_time'] = min(rec['timestamps'])
-                    total_el = ast.find('.//TotalAmount')
-                    if total_el is not None:
-                        try:
-                            rec['explicit_total'] = float(total_el.text or 0)
-                        except:
-                            pass
-                    for tdet in ast.findall('.//TransactionDetail'):
-                        group = tdet.find('TransactionDetailGroup')
-                        if group is not None:
-                            for line_el in group.findall('TransactionDetailLine'):
-                                promo_id = line_el.findtext('PromotionID')
-                                if promo_id:
-                                    rec['promotions'].add(promo_id)
-                                mid = line_el.findtext('MarkdownItemID')
-                                depc = line_el.findtext('MarkdownDepartmentID')
-                                if mid and depc:
-                                    qty_text = (line_el.findtext('TriggeredQty') or line_el.findtext('AllocatedQty') or '1')
-                                    amt_text = (line_el.findtext('Amount') or '0')
-                                    try:
-                                        qty_val = float(qty_text)
-                                    except:
-                                        qty_val = 1.0
-                                    try:
-                                        amt_val = float(amt_text)
-                                    except:
-                                        amt_val = 0.0
-                                    rec['items'].append({
-                                        'plu': mid,
-                                        'name': '(markdown item)',
-                                        'depCode': depc,
-                                        'qty': qty_val,
-                                        'price': 0.0,
-                                        'amount': amt_val
-                                    })
-                    for psum in ast.findall('.//PromotionSummary'):
-                        p_id = psum.findtext('RedeemedPromotionId')
-                        if p_id:
-                            rec['promotions'].add(p_id)
-                    parse_loyalty_xml(ast, rec['loyalty_info'])
-    # --------------------------------------------------------------------------
+        parse_biztalk_xml(biztalk, transactions)
+
     # PART 3: <Customer ...> branch
-    # --------------------------------------------------------------------------
     # If the root itself is a Customer, process it.
-    def is_customer(elem):
-        return elem.tag.endswith('Customer')
-    if is_customer(root):
+    if _is_customer(root):
         customers = [root]
     else:
-        customers = root.findall('.//Customer')
+        customers = root.iterdescendants('Customer')
     for cust in customers:
-        txid = cust.get('TransID')
-        if not txid:
-            continue
-        init_transaction(txid, transactions)
-        rec = transactions[txid]
-        cardid = cust.get('CardID')
-        if cardid:
-            rec['card_id'] = cardid
-        ttot = cust.get('TicketTotal')
-        if ttot:
-            try:
-                rec['explicit_total'] = float(ttot)
-            except:
-                pass
-        scan_for_timestamps(cust, rec)
-        if rec['transaction_time'] is None and rec['timestamps']:
-            rec['transaction_time'] = min(rec['timestamps'])
-        xml_str = etree.tostring(cust, encoding=str)
-        merge_transaction_info(xml_str, transactions)
+        parse_customer_xml(cust, transactions)
+
+###############################################################################
+# <Session> LPE handlers: (subroot, transactions, current_ticket) -> current_ticket
+###############################################################################
+def _lpe_set_param(subroot, transactions, current_ticket):
+    sysparams = _first_descendant(subroot, 'SystemParameters')
+    if sysparams is not None:
+        current_ticket = sysparams.get('TicketNumber')
+        store_id = _intern(sysparams.get('StoreID'))
+        cashier_id = _intern(sysparams.get('CashierID'))
+        if current_ticket:
+            init_transaction(current_ticket, transactions)
+            rec = transactions[current_ticket]
+            rec.storeID = store_id
+            rec.cashierID = cashier_id
+            scan_for_timestamps(subroot, rec)
+    return current_ticket
+
+def _lpe_add_item(subroot, transactions, current_ticket):
+    if not current_ticket:
+        return current_ticket
+    rec = transactions[current_ticket]
+    item_info = _first_descendant(subroot, 'ItemInfo')
+    if item_info is not None:
+        plu = _intern(item_info.get('PluCode', ''))
+        nm  = item_info.get('Name', '').strip()
+        dep = _intern(item_info.get('DepCode', ''))
+        amt_val = _fnum(item_info, 'Amount')
+        qty_val = _fnum(item_info, 'Quantity', 1.0)
+        base_price = _fnum(item_info, 'Price')
+        prices_el = _xp_first(_XP_PRICES_PRICE, item_info)
+        subprice_val = float(prices_el.get('Price','0')) if prices_el is not None else base_price
+        _append(rec, 'items', {
+            'plu': plu,
+            'name': nm,
+            'depCode': dep,
+            'qty': qty_val,
+            'price': subprice_val,
+            'amount': amt_val,
+        })
+    scan_for_timestamps(subroot, rec)
+    return current_ticket
+
+def _lpe_add_tender(subroot, transactions, current_ticket):
+    if not current_ticket:
+        return current_ticket
+    rec = transactions[current_ticket]
+    tend_el = _first_descendant(subroot, 'TenderInfo')
+    if tend_el is not None:
+        amt = _fnum(tend_el, 'Amount')
+        _append(rec, 'tenders', {
+            'tenderNo': tend_el.get('TenderNo'),
+            'amount': amt,
+            'tenderType': tend_el.get('TenderType') or ''
+        })
+    scan_for_timestamps(subroot, rec)
+    return current_ticket
+
+def _lpe_add_document(subroot, transactions, current_ticket):
+    if not current_ticket:
+        return current_ticket
+    rec = transactions[current_ticket]
+    docinfo = _first_descendant(subroot, 'DocumentInfo')
+    if docinfo is not None:
+        for d in docinfo.findall('Document'):
+            _append(rec, 'documents', {
+                'documentType': d.get('DocumentType'),
+                'barcode': d.get('Barcode'),
+                'confirmationLevel': d.get('ConfirmationLevel'),
+                'promotionId': d.get('PromotionId'),
+                'description': d.get('PromotionDescription')
+            })
+    scan_for_timestamps(subroot, rec)
+    return current_ticket
+
+def _lpe_triggered_promotions(subroot, transactions, current_ticket):
+    if not current_ticket:
+        return current_ticket
+    rec = transactions[current_ticket]
+    for dl in subroot.iterdescendants('DiscountLine'):
+        pn = dl.get('PromNumber')
+        if pn:
+            _add(rec, 'promotions', pn)
+    scan_for_timestamps(subroot, rec)
+    return current_ticket
+
+def _lpe_query_response(subroot, transactions, current_ticket):
+    titems_node = _first_descendant(subroot, 'TicketItems')
+    if titems_node is not None:
+        if not current_ticket:
+            gdata = _first_descendant(subroot, 'GeneralData')
+            if gdata is not None:
+                tnum = gdata.get('TicketNumber')
+                if tnum:
+                    current_ticket = tnum
+                    init_transaction(tnum, transactions)
+        if current_ticket:
+            rec = transactions[current_ticket]
+            for iel in titems_node.findall('Item'):
+                pl   = _intern(iel.get('PluCode',''))
+                dep  = _intern(iel.get('DepCode',''))
+                qty  = _fnum(iel, 'Quantity', 1.0)
+                price= _fnum(iel, 'Price')
+                rew  = _fnum(iel, 'RewardAmount')
+                if rew == 0:
+                    rew = price*qty
+                _append(rec, 'items', {
+                    'plu': pl,
+                    'name': '',
+                    'depCode': dep,
+                    'qty': qty,
+                    'price': price,
+                    'amount': rew
+                })
+            parse_loyalty_xml(subroot, rec)
+            scan_for_timestamps(subroot, rec)
+    return current_ticket
+
+# LPE Method -> handler, applied when the LPE body parses as XML
+LPE_HANDLERS = {
+    'SetParam': _lpe_set_param,
+    'AddItem': _lpe_add_item,
+    'AddTender': _lpe_add_tender,
+    'AddDocument': _lpe_add_document,
+    'AddDocument(Response)': _lpe_add_document,
+    'GetTriggeredPromotions': _lpe_triggered_promotions,
+    'Query(Response)': _lpe_query_response,
+}
+
+def _strip_xml_decl(xml_str):
+    """Removes <?xml ...?> declarations; the leading one is cut without the regex."""
+    if xml_str.startswith('<?xml') and xml_str[5:6].isspace():
+        end = xml_str.find('?>')
+        if end != -1:
+            xml_str = xml_str[end + 2:]
+    if '<?xml' in xml_str:
+        xml_str = RE_XML_DECL.sub('', xml_str)
+    return xml_str.strip()
+
+def parse_session_xml(session, transactions):
+    """Harvests the LPE messages of a <Session> element into 'transactions'."""
+    current_ticket = None
+    handlers = LPE_HANDLERS
+    for lpe in session.findall('LPE'):
+        # The payload is normally one text/CDATA node; join only mixed content.
+        xml_str = (lpe.text or '') if len(lpe) == 0 else "".join(lpe.itertext())
+        xml_str = xml_str.strip()
+        xml_str = _strip_xml_decl(xml_str)
         try:
             subroot = etree.fromstring(xml_str.encode('utf-8', errors='replace'))
-            parse_loyalty_xml(subroot, rec['loyalty_info'])
         except Exception:
+            subroot = None
+        handler = handlers.get(lpe.get('Method'))
+        if handler is not None and subroot is not None:
+            current_ticket = handler(subroot, transactions, current_ticket)
+        merge_transaction_info(xml_str, transactions)
+
+def parse_biztalk_xml(biztalk, transactions):
+    """Harvests an ActiveStore sales transaction from a <biztalk_1> element."""
+    body = biztalk.find('body')
+    if body is not None:
+        ast = body.find('ActiveStore_SalesTransaction_1.70')
+        if ast is not None:
+            tx_number  = ast.findtext('TransactionNumber')
+            store_id   = _intern(ast.findtext('StoreID'))
+            cashier_id = _intern(ast.findtext('CashierID'))
+            if tx_number:
+                init_transaction(tx_number, transactions)
+                rec = transactions[tx_number]
+                rec.storeID = store_id
+                rec.cashierID = cashier_id
+                scan_for_timestamps(ast, rec)
+                total_el = _first_descendant(ast, 'TotalAmount')
+                if total_el is not None:
+                    try:
+                        rec.explicit_total = float(total_el.text or 0)
+                    except:
+                        pass
+                for tdet in ast.iterdescendants('TransactionDetail'):
+                    group = tdet.find('TransactionDetailGroup')
+                    if group is not None:
+                        for line_el in group.findall('TransactionDetailLine'):
+                            promo_id = line_el.findtext('PromotionID')
+                            if promo_id:
+                                _add(rec, 'promotions', promo_id)
+                            mid = _intern(line_el.findtext('MarkdownItemID'))
+                            depc = _intern(line_el.findtext('MarkdownDepartmentID'))
+                            if mid and depc:
+                                qty_val = _ftext(line_el.findtext('TriggeredQty') or line_el.findtext('AllocatedQty'), 1.0)
+                                amt_val = _ftext(line_el.findtext('Amount'), 0.0)
+                                _append(rec, 'items', {
+                                    'plu': mid,
+                                    'name': '(markdown item)',
+                                    'depCode': depc,
+                                    'qty': qty_val,
+                                    'price': 0.0,
+                                    'amount': amt_val
+                                })
+                for psum in ast.iterdescendants('PromotionSummary'):
+                    p_id = psum.findtext('RedeemedPromotionId')
+                    if p_id:
+                        _add(rec, 'promotions', p_id)
+                parse_loyalty_xml(ast, rec)
+
+def parse_customer_xml(cust, transactions):
+    """Harvests a single <Customer ...> element (keyed by its TransID)."""
+    txid = cust.get('TransID')
+    if not txid:
+        return
+    init_transaction(txid, transactions)
+    rec = transactions[txid]
+    cardid = cust.get('CardID')
+    if cardid:
+        rec.card_id = cardid
+    ttot = cust.get('TicketTotal')
+    if ttot:
+        try:
+            rec.explicit_total = float(ttot)
+        except:
             pass
+    scan_for_timestamps(cust, rec)
+    merge_transaction_info_elem(cust, transactions)
+    parse_loyalty_xml(cust, rec)
 
 ###############################################################################
-# Attempts to parse a file as XML, either single-root or multiple top-level chunks
+# Streams an XML file (single root or several top-level elements)
 ###############################################################################
+# Bytes fed to the pull parser at a time
+PULL_FEED_SIZE = 1 << 20
+
+# Sections harvested (and then freed) as soon as their end tag is parsed
+SECTION_PARSERS = {
+    'Session': parse_session_xml,
+    'biztalk_1': parse_biztalk_xml,
+    'Customer': parse_customer_xml,
+}
+
+def _free_parsed(elem):
+    """
+    Releases a finished element and its preceding siblings. The element itself
+    stays attached: libxml2 may still reference it while parsing what follows.
+    """
+    elem.clear()
+    parent = elem.getparent()
+    while elem.getprevious() is not None:
+        del parent[0]
+
 def parse_big_xml(filepath, transactions, source_file=None):
     """
-    1) Reads the entire file (strips BOM if present).
-    2) Tries to parse as a single XML root (fromstring). If that fails with 
-       multiple-root issues, parse each top-level <...> chunk in a fallback loop.
-    3) For each parsed root, calls parse_single_xml(...) to harvest data into 'transactions'.
-    4) Yields rows (dicts) with 'combined_ts' set to the earliest discovered tx time in that chunk.
+    1) Feeds the file in PULL_FEED_SIZE pieces to an XMLPullParser, wrapped in a
+       sentinel root so files with several top-level elements parse as well
+       (BOM and XML declaration are handled).
+    2) Every <Session>, <biztalk_1> and <Customer> subtree (and any top-level element
+       whose tag ends with 'Customer') is harvested into 'transactions' when it ends,
+       yielded as a row and cleared, so memory is bounded by the largest section
+       rather than the file.
+    3) Top-level elements without any of these sections are yielded as one row each.
+    Rows carry the transaction ids first seen in that subtree, and 'combined_ts' is
+    the earliest transaction time among them. A row's raw_line is the serialized
+    subtree: the fed bytes are not kept and the pull parser reports no byte
+    offsets, so the source text of a section cannot be sliced out instead.
     """
-    with open(filepath, 'rb') as f:
-        data = f.read()
-    BOM_UTF8 = codecs.BOM_UTF8
-    if data.startswith(BOM_UTF8):
-        data = data[len(BOM_UTF8):]
-    def earliest_new_tx_time(before_keys):
+    def new_tx_ids(before_count):
+        # 'transactions' only grows and keeps insertion order, so the ids added
+        # since before_count are its last entries.
+        added = len(transactions) - before_count
+        return list(islice(reversed(transactions), added))[::-1]
+
+    def earliest_tx_time(tx_ids):
         earliest_dt = None
-        after_keys = set(transactions.keys())
-        new_keys = after_keys - before_keys
-        for k in new_keys:
-            dt = transactions[k].get('transaction_time')
+        for k in tx_ids:
+            dt = transactions[k].transaction_time
             if dt and (earliest_dt is None or dt < earliest_dt):
                 earliest_dt = dt
         return earliest_dt
-    text_str = data.decode('utf-8', errors='replace').strip()
-    before_keys = set(transactions.keys())
-    try:
-        root = etree.fromstring(data)
-        parse_single_xml(root, transactions, source_file=source_file)
-        chunk_dt = earliest_new_tx_time(before_keys)
-        chunk_ts = chunk_dt.timestamp() if chunk_dt else None
-        yield {
-            'raw_line': etree.tostring(root, encoding=str),
-            'combined_ts': chunk_ts,
-            'log_level': None,
-            'trans_ids': list(transactions.keys()),
-            'source_file': source_file
-        }
-        return
-    except Exception as e:
-        print(f"[parse_big_xml] Single-root parse failed for {filepath}: {e}")
-        pass
-    idx = 0
-    length = len(text_str)
-    while idx < length:
-        while idx < length and text_str[idx].isspace():
-            idx += 1
-        if idx >= length or text_str[idx] != '<':
-            break
-        start_idx = idx
-        bracket_count = 1
-        idx += 1
-        while idx < length:
-            open_tag = text_str.find("<", idx)
-            close_tag = text_str.find(">", idx)
-            if close_tag == -1:
-                idx = length
-                break
-            if open_tag == -1 or open_tag > close_tag:
-                bracket_count -= 1
-                idx = close_tag + 1
-                if bracket_count == 0:
-                    break
+
+    def section_parser(elem, depth):
+        handler = SECTION_PARSERS.get(elem.tag)
+        if handler is None and depth == 2 and _is_customer(elem):
+            handler = parse_customer_xml
+        return handler
+
+    parser = etree.XMLPullParser(events=('start', 'end'), recover=True, huge_tree=True)
+    depth = 0               # 1 = sentinel root, 2 = top-level elements of the file
+    open_sections = 0       # sections currently being parsed (they may nest)
+    top_has_section = False # whether the current top-level element held a section
+
+    with open(filepath, 'rb') as f:
+        head = f.read(PULL_FEED_SIZE)
+        if head.startswith(codecs.BOM_UTF8):
+            head = head[len(codecs.BOM_UTF8):]
+        head = head.lstrip()
+        if head.startswith(b'<?xml'):
+            decl_end = head.find(b'?>')
+            if decl_end != -1:
+                parser.feed(head[:decl_end + 2])
+                head = head[decl_end + 2:]
+        parser.feed(b'<__root__>')
+        chunk = head
+        while True:
+            if chunk:
+                parser.feed(chunk)
             else:
-                bracket_count += 1
-                idx = open_tag + 1
-        chunk = text_str[start_idx:idx].strip()
-        before_keys_chunk = set(transactions.keys())
-        try:
-            subroot = etree.fromstring(chunk.encode('utf-8', errors='replace'))
-            parse_single_xml(subroot, transactions, source_file=source_file)
-            chunk_dt = earliest_new_tx_time(before_keys_chunk)
-            chunk_ts = chunk_dt.timestamp() if chunk_dt else None
-            yield {
-                'raw_line': chunk,
-                'combined_ts': chunk_ts,
-                'log_level': None,
-                'trans_ids': list(transactions.keys()),
-                'source_file': source_file
-            }
-        except Exception as e:
-            print(f"[parse_big_xml] Chunk parse error in file {filepath}: {e}")
-            pass
+                parser.feed(b'</__root__>')
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    depth += 1
+                    if section_parser(elem, depth) is not None:
+                        open_sections += 1
+                    continue
+
+                handler = section_parser(elem, depth)
+                if handler is not None:
+                    open_sections -= 1
+                    top_has_section = True
+                    before_count = len(transactions)
+                    try:
+                        handler(elem, transactions)
+                        tx_ids = new_tx_ids(before_count)
+                        chunk_dt = earliest_tx_time(tx_ids)
+                        chunk_ts = chunk_dt.timestamp() if chunk_dt else None
+                        yield LogRow(etree.tostring(elem, encoding=str, with_tail=False), chunk_ts, None,
+                                     tx_ids, source_file)
+                    except Exception as e:
+                        print(f"[parse_big_xml] Section parse error in file {filepath}: {e}")
+                    if open_sections == 0:
+                        _free_parsed(elem)
+
+                if depth == 2:
+                    if not top_has_section:
+                        yield LogRow(etree.tostring(elem, encoding=str, with_tail=False), None, None,
+                                     [], source_file)
+                    top_has_section = False
+                    _free_parsed(elem)
+                depth -= 1
+            if not chunk:
+                break
+            chunk = f.read(PULL_FEED_SIZE)
+    parser.close()
@@ -1,48 +1,112 @@
 
 import re
 import logging
+import codecs
+import functools
 import hashlib
+from sys import intern
+from dataclasses import dataclass, field
+from typing import Optional
 from lxml import etree
 from datetime import datetime
-from copy import deepcopy
+
+try:
+    # Optional: xxHash (xxh3) is far cheaper than SHA-256 for the dedup keys below.
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    # Optional: ciso8601's C parser for the ISO StartDateTime (see parse_iso_datetime).
+    from ciso8601 import parse_datetime as _parse_iso
+except ImportError:
+    _parse_iso = None
 
 logger = logging.getLogger(__name__)
 
+# Dedup key of a byte string (fragments, item keys). Only compared, never stored
+# outside a transaction record, so a non-cryptographic hash is enough.
+if xxhash is not None:
+    _digest = xxhash.xxh3_128_intdigest
+else:
+    def _digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+
+# Session time formats: StartTime Date/Time and GeneralData TransactionDate/Time
+START_TIME_FMT = "%d/%m/%y %H:%M:%S.%f"
+GENERAL_DATA_FMT = "%d/%m/%Y %H:%M:%S"
+# Their zero-padded shapes, sliced without strptime
+_FIXED_DATETIME_RES = {
+    START_TIME_FMT: re.compile(r'([0-9]{2})/([0-9]{2})/([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})\.([0-9]{1,6})'),
+    GENERAL_DATA_FMT: re.compile(r'([0-9]{2})/([0-9]{2})/([0-9]{4}) ([0-9]{2}):([0-9]{2}):([0-9]{2})'),
+}
+
+@functools.lru_cache(maxsize=4096)
+def parse_fixed_datetime(text, fmt):
+    """
+    datetime.strptime(text, fmt), cached (files of one session share their start
+    time). The usual zero-padded shapes of the formats above are built directly.
+    """
+    pattern = _FIXED_DATETIME_RES.get(fmt)
+    m = pattern.fullmatch(text) if pattern is not None else None
+    if m is None:
+        return datetime.strptime(text, fmt)
+    day, month, year, hour, minute, second = map(int, m.group(1, 2, 3, 4, 5, 6))
+    if fmt == START_TIME_FMT:
+        year += 2000 if year < 69 else 1900  # strptime's %y pivot
+        micro = int(m.group(7).ljust(6, '0'))
+    else:
+        micro = 0
+    return datetime(year, month, day, hour, minute, second, micro)
 
-def extract_timestamp(root):
+@functools.lru_cache(maxsize=1024)
+def parse_iso_datetime(text):
+    """
+    datetime.fromisoformat(text), cached like parse_fixed_datetime. Uses ciso8601
+    when installed, falling back to fromisoformat for anything it rejects.
+    """
+    if _parse_iso is not None:
+        try:
+            return _parse_iso(text)
+        except ValueError:
+            pass
+    return datetime.fromisoformat(text)
+
+def timestamp_from_attrs(start_time, customer, general_data):
+    """
+    Session start time from the attributes of the first <Session>/<StartTime>,
+    <Customer> and <GeneralData> elements (None where absent), tried in that order.
+    """
     # 1. Try Session/StartTime (expected format: Date="28/01/25", Time="10:07:02.292")
-    st_elem = root.find('.//Session/StartTime')
-    if st_elem is not None:
-        date_str = st_elem.get('Date')
-        time_str = st_elem.get('Time')
+    if start_time is not None:
+        date_str = start_time.get('Date')
+        time_str = start_time.get('Time')
         if date_str and time_str:
             try:
                 # Adjust the format if needed (here: day/month/yy H:M:S.micro)
-                return datetime.strptime(f"{date_str} {time_str}", "%d/%m/%y %H:%M:%S.%f")
+                return parse_fixed_datetime(f"{date_str} {time_str}", START_TIME_FMT)
             except Exception as e:
                 # log or ignore parsing errors
                 pass
 
     # 2. Try the Customer element’s StartDateTime attribute (ISO format, e.g. "2025-01-28T10:07:01")
-    cust_elem = root.find('.//Customer')
-    if cust_elem is not None:
-        start_dt = cust_elem.get('StartDateTime')
+    if customer is not None:
+        start_dt = customer.get('StartDateTime')
         if start_dt:
             try:
-                # If the value is in ISO format, datetime.fromisoformat works well:
-                return datetime.fromisoformat(start_dt)
+                return parse_iso_datetime(start_dt)
             except Exception as e:
                 pass
 
     # 3. Try the GeneralData element in Query(Response)
-    gd_elem = root.find('.//GeneralData')
-    if gd_elem is not None:
-        trans_date = gd_elem.get('TransactionDate')
-        trans_time = gd_elem.get('TransactionTime')
+    if general_data is not None:
+        trans_date = general_data.get('TransactionDate')
+        trans_time = general_data.get('TransactionTime')
         if trans_date and trans_time:
             try:
                 # Assuming TransactionDate is "28/01/2025" and TransactionTime "10:07:01"
-                return datetime.strptime(f"{trans_date} {trans_time}", "%d/%m/%Y %H:%M:%S")
+                return parse_fixed_datetime(f"{trans_date} {trans_time}", GENERAL_DATA_FMT)
             except Exception as e:
                 pass
 
@@ -50,106 +114,187 @@ def extract_timestamp(root):
     return None
 
 ###############################################################################
-# 1) Helper: Clean XML declarations as before
+# 2) Stream the file through a pull parser, wrapped in a synthetic root.
 ###############################################################################
-def clean_xml_declarations(content: str) -> str:
-    declarations = re.findall(r'<\?xml.*?\?>', content, flags=re.DOTALL)
-    if not declarations:
-        return content
-    first_decl = declarations[0]
-    content = re.sub(r'<\?xml.*?\?>', '', content, flags=re.DOTALL)
-    return first_decl + "\n" + content.strip()
+# Bytes fed to the pull parser at a time
+PROM_FEED_SIZE = 1 << 20
 
-###############################################################################
-# 2) Instead of splitting via regex, stream the file by wrapping it in a root.
-###############################################################################
-def iterparse_prom_xml(filepath: str):
+# Whether each record keeps the attributes of every processed element in
+# raw_fragment_attributes. They duplicate what the handlers extract and walk
+# whole subtrees, so this is off unless the raw attributes are wanted.
+CAPTURE_RAW_ATTRIBUTES = False
+
+# Elements whose first occurrence may carry the session start time
+_STAMP_TAGS = ('StartTime', 'Customer', 'GeneralData')
+
+def iterparse_prom_xml(filepath: str, stamps=None):
     """
-    Reads the file, cleans XML declarations, wraps it in a synthetic <Logs> root,
-    and yields each <LPE> element using lxml.
+    Feeds the file in PROM_FEED_SIZE pieces to an XMLPullParser inside a synthetic
+    <Logs> root and yields each <LPE> element (in document order) once its outermost
+    <LPE> has ended. After the caller is done with it the element is cleared and
+    earlier siblings are dropped, so memory stays bounded by one LPE.
+    The file is read and fed as bytes, never decoded to str and re-encoded.
+    A leading XML declaration (after an optional BOM) is fed before <Logs>; later
+    ones are skipped by the recovering parser.
+    If 'stamps' is a dict, the attributes of the first <Session>/<StartTime>,
+    <Customer> and <GeneralData> are stored in it under their tag names.
     """
-    with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-        content = f.read()
-    # Clean extra XML declarations.
-    content = clean_xml_declarations(content)
-    # Wrap the content in a synthetic root so the entire file is well-formed.
-    wrapped = "<Logs>\n" + content + "\n</Logs>"
-    try:
-        # Parse the wrapped content.
-        parser = etree.XMLParser(recover=True, remove_blank_text=True)
-        root = etree.fromstring(wrapped.encode('utf-8'), parser=parser)
-    except etree.XMLSyntaxError as e:
-        logger.error(f"Error parsing wrapped XML: {e}")
-        return
-    # Yield each LPE element.
-    for lpe_elem in root.findall('.//LPE'):
-        yield lpe_elem
+    parser = etree.XMLPullParser(events=('end',), tag=('LPE',) + _STAMP_TAGS,
+                                 recover=True, remove_blank_text=True, huge_tree=True)
+    with open(filepath, 'rb') as f:
+        head = f.read(PROM_FEED_SIZE)
+        if head.startswith(codecs.BOM_UTF8):
+            head = head[len(codecs.BOM_UTF8):]
+        head = head.lstrip()
+        if head.startswith(b'<?xml'):
+            decl_end = head.find(b'?>')
+            if decl_end != -1:
+                parser.feed(head[:decl_end + 2])
+                head = head[decl_end + 2:]
+        parser.feed(b'<Logs>\n')
+        chunk = head
+        while True:
+            if chunk:
+                parser.feed(chunk)
+            else:
+                parser.feed(b'\n</Logs>')
+            for _, elem in parser.read_events():
+                tag = elem.tag
+                if tag != 'LPE':
+                    if stamps is not None and tag not in stamps:
+                        if tag != 'StartTime' or elem.getparent().tag == 'Session':
+                            stamps[tag] = dict(elem.attrib)
+                    continue
+                if next(elem.iterancestors('LPE'), None) is not None:
+                    continue  # yielded with its outermost <LPE>
+                yield from elem.iter('LPE')
+                # Release the finished LPE (kept attached: libxml2 may still use it).
+                elem.clear()
+                parent = elem.getparent()
+                while elem.getprevious() is not None:
+                    del parent[0]
+            if not chunk:
+                break
+            chunk = f.read(PROM_FEED_SIZE)
+    parser.close()
 
 ###############################################################################
 # 3) Transaction aggregator functions (init_transaction, etc.)
 ###############################################################################
+@dataclass(slots=True)
+class PromTransaction:
+    """
+    Aggregated data of one prom transaction. Slotted like msg_parser's
+    Transaction; get()/[] keep the read access of the former dict records.
+    """
+    trans_id: str
+    storeID: Optional[str] = None
+    cashierID: Optional[str] = None
+    card_id: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    phone_numbers: set = field(default_factory=set)
+    promotions: set = field(default_factory=set)
+    items: list = field(default_factory=list)
+    # Item key -> index in items, for deduplication
+    item_keys: dict = field(default_factory=dict)
+    documents: list = field(default_factory=list)
+    tenders: list = field(default_factory=list)
+    promo_items: list = field(default_factory=list)
+    transaction_time: Optional[datetime] = None
+    explicit_total: Optional[float] = None
+    loyalty_info: dict = field(default_factory=lambda: {
+        'balances': [],
+        'accounts': [],
+        'members': [],
+        'segments': []
+    })
+    loyalty_summary: Optional[str] = None
+    savers_summary: Optional[str] = None
+    queries: list = field(default_factory=list)
+    raw_fragment_attributes: list = field(default_factory=list)
+    promotion_details: list = field(default_factory=list)
+    other_fragments: list = field(default_factory=list)
+    init_info: Optional[dict] = None
+    active_devices: Optional[list] = None
+    # Hashes of the fragments already processed, to skip duplicates
+    processed_fragments: set = field(default_factory=set)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
 def init_transaction(txid, transactions):
     if txid not in transactions:
-        transactions[txid] = {
-            'trans_id': txid,
-            'storeID': None,
-            'cashierID': None,
-            'card_id': None,
-            'first_name': None,
-            'last_name': None,
-            'phone_numbers': set(),
-            'promotions': set(),
-            'items': [],
-            # New dictionary to keep track of item keys for deduplication:
-            'item_keys': {},
-            'documents': [],
-            'tenders': [],
-            'promo_items': [],
-            'transaction_time': None,
-            'explicit_total': None,
-            'loyalty_info': {
-                'balances': [],
-                'accounts': [],
-                'members': [],
-                'segments': []
-            },
-            'loyalty_summary': None,
-            'savers_summary': None,
-            'queries': [],
-            'raw_fragment_attributes': [],
-            'promotion_details': [],
-            'other_fragments': [],
-            # Optional: to avoid processing duplicate fragments:
-            'processed_fragments': set()
-        }
+        transactions[txid] = PromTransaction(txid)
 
 ###############################################################################
 # 4) Loyalty sub-parsing and attribute extraction (unchanged)
 ###############################################################################
+# The element and its descendants that carry attributes, in document order
+_XP_ATTRIBUTED = etree.XPath('descendant-or-self::*[@*]')
+
 def extract_all_attributes(element):
     all_attrs = {}
-    for elem in element.iter():
-        tag = elem.tag
-        if elem.attrib:
-            all_attrs.setdefault(tag, []).append(dict(elem.attrib))
+    for elem in _XP_ATTRIBUTED(element):
+        all_attrs.setdefault(intern(elem.tag), []).append(dict(elem.attrib))
     return all_attrs
 
+def _capture_attributes(rec, element):
+    """Appends extract_all_attributes(element) to rec.raw_fragment_attributes if CAPTURE_RAW_ATTRIBUTES."""
+    if CAPTURE_RAW_ATTRIBUTES:
+        rec.raw_fragment_attributes.append(extract_all_attributes(element))
+
+# Precompiled attribute query for merge_extra_info: the card and phone
+# attributes of the whole subtree in one walk, in document order. Smart
+# strings carry the attribute name; values are stored as plain str copies.
+_XP_EXTRA_ATTRS = etree.XPath('.//@CardID | .//@MobilePhoneNumber | .//@HomePhone')
+
+# (attribute, default) of the numeric fields read per item
+_ITEM_INFO_FLOATS = (('Quantity', 1.0), ('Amount', 0.0), ('Price', 0.0), ('QuantityInPrice', 1.0))
+_TICKET_ITEM_FLOATS = (('Quantity', 1.0), ('Price', 0.0), ('RewardAmount', 0.0))
+
+def _floats(el, spec):
+    """float() of each (key, default) attribute of 'el' (element or .attrib) in 'spec'; the default if missing or not a number."""
+    values = []
+    for key, default in spec:
+        v = el.get(key)
+        if v is None:
+            values.append(default)
+            continue
+        try:
+            values.append(float(v))
+        except ValueError:
+            values.append(default)
+    return values
+
+def _first_descendant(element, tag):
+    """First descendant of 'element' with the given tag, or None (like find('.//tag'))."""
+    return next(element.iterdescendants(tag), None)
+
 def merge_extra_info(element, current_tx, transactions):
-    # Capture CardID if available.
-    card_ids = element.xpath('.//@CardID')
-    if card_ids:
-        transactions[current_tx]['card_id'] = card_ids[0]
-    # Capture phone numbers (if any)
-    phones = element.xpath('.//@MobilePhoneNumber') + element.xpath('.//@HomePhone')
-    for num in phones:
-        transactions[current_tx]['phone_numbers'].add(num)
+    rec = transactions[current_tx]
+    card_id = None
+    for value in _XP_EXTRA_ATTRS(element):
+        if value.attrname == 'CardID':
+            # Capture the first CardID
+            if card_id is None:
+                card_id = str(value)
+        else:
+            # Capture phone numbers
+            rec.phone_numbers.add(str(value))
+    if card_id is not None:
+        rec.card_id = card_id
     # Also capture names if available
     fn = element.get('FirstName')
     ln = element.get('LastName')
     if fn:
-        transactions[current_tx]['first_name'] = fn
+        rec.first_name = fn
     if ln:
-        transactions[current_tx]['last_name'] = ln
+        rec.last_name = ln
     return
 
 ###############################################################################
@@ -160,339 +305,396 @@ def get_item_key(item_info):
     plu = item_info.get('PluCode', '').strip()
     pos_seq = item_info.get('PosSequence', '').strip()
     dep = item_info.get('DepCode', '').strip()
-    key_str = f"{plu}_{pos_seq}_{dep}"
-    return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+    key_str = f"{plu}\0{pos_seq}\0{dep}"
+    return _digest(key_str.encode('utf-8'))
     # Alternatively, simply: return key_str
 
 ###############################################################################
 # 5) Revised LPE Fragment Processor – collects ALL information!
 ###############################################################################
-def process_lpe_fragment(fragment, method, transactions, current_tx=None):
-    # Compute a hash for this fragment so that duplicates are skipped.
-    fragment_raw = etree.tostring(fragment, encoding='utf-8') # type: ignore
-    frag_hash = hashlib.sha256(fragment_raw).hexdigest()
-    if current_tx and frag_hash in transactions[current_tx].get('processed_fragments', set()):
-        logger.debug(f"Skipping duplicate fragment with hash {frag_hash} in transaction {current_tx}")
-        return current_tx
-    if current_tx:
-        transactions[current_tx].setdefault('processed_fragments', set()).add(frag_hash)
-
-    # ----- Branch: SetParam (initialize transaction) -----
-    if method == 'SetParam':
-        sysparams = fragment.find('.//SystemParameters')
-        if sysparams is not None:
-            txid = sysparams.get('TicketNumber')
-            if txid:
-                init_transaction(txid, transactions)
-                transactions[txid]['storeID'] = sysparams.get('StoreID')
-                transactions[txid]['cashierID'] = sysparams.get('CashierID')
-                merge_extra_info(sysparams, txid, transactions)
-                current_tx = txid
-                transactions[txid]['raw_fragment_attributes'].append(extract_all_attributes(sysparams))
-                transactions[txid].setdefault('other_fragments', []).append({
-                    'method': method,
-                    'raw': etree.tostring(sysparams, encoding='unicode')
-                })
-                return current_tx
-
-    # ----- Branch: Init -----
-    elif method == 'Init' and current_tx:
-        init_info = fragment.find('.//InitInfo')
-        if init_info is not None:
-            transactions[current_tx]['init_info'] = dict(init_info.attrib)
-            active_devices = init_info.find('.//ActiveDevices')
-            if active_devices is not None:
-                devices = [dict(ad.attrib) for ad in active_devices.findall('ActiveDevice')]
-                transactions[current_tx]['active_devices'] = devices
-            merge_extra_info(init_info, current_tx, transactions)
-            transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(init_info))
-
-    # ----- Branch: AddItem -----
-    elif method == 'AddItem' and current_tx:
-        item_info = fragment.find('.//ItemInfo')
-        if item_info is not None:
-            rec = transactions[current_tx]
-            key = get_item_key(item_info)
-            plu  = item_info.get('PluCode', '')
-            name = item_info.get('Name', '').strip()
-            dep  = item_info.get('DepCode', '')
-            pos_seq = item_info.get('PosSequence', None)
-            qty_str   = item_info.get('Quantity', '1')
-            amt_str   = item_info.get('Amount', '0')
-            price_str = item_info.get('Price', '0')
-            qip_str   = item_info.get('QuantityInPrice', '1')
-            try:
-                qty_val = float(qty_str)
-            except ValueError:
-                qty_val = 1.0
-            try:
-                amt_val = float(amt_str)
-            except ValueError:
-                amt_val = 0.0
-            try:
-                base_price = float(price_str)
-            except ValueError:
-                base_price = 0.0
-            try:
-                qip_val = float(qip_str)
-            except ValueError:
-                qip_val = 1.0
-            prices_el = item_info.find('.//Prices/Price')
-            if prices_el is not None:
-                raw_subprice = prices_el.get('Price', '0')
-                try:
-                    subprice_val = float(raw_subprice)
-                except ValueError:
-                    subprice_val = base_price
-            else:
-                subprice_val = base_price
-            final_price = subprice_val
-            final_qty   = qty_val
-            final_amt   = amt_val
-            item_data = {
-                'plu': plu,
-                'name': name,
-                'depCode': dep,
-                'posSequence': pos_seq,
-                'qty': final_qty,
-                'price': final_price,
-                'amount': final_amt,
-                'quantity_in_price': qip_val,
-                'raw': etree.tostring(item_info, encoding='unicode'),
-                'key': key
-            }
-            if 'item_keys' not in rec:
-                rec['item_keys'] = {}
-            if key in rec['item_keys']:
-                idx = rec['item_keys'][key]
-                rec['items'][idx]['qty'] += final_qty
-                rec['items'][idx]['amount'] += final_amt
-                logger.debug(f"Merged item with key {key} (PLU {plu}) in transaction {current_tx}")
-            else:
-                rec['items'].append(item_data)
-                rec['item_keys'][key] = len(rec['items']) - 1
-                logger.debug(f"Added new item with key {key} (PLU {plu}) in transaction {current_tx}")
-            merge_extra_info(item_info, current_tx, transactions)
-            rec.setdefault('raw_fragment_attributes', []).append(extract_all_attributes(item_info))
-
-    # ----- Branch: Query(Response) -----
-    elif method == 'Query(Response)':
-        gdata = fragment.find('.//GeneralData')
-        if gdata is not None:
-            tnum = gdata.get('TicketNumber')
-            if tnum:
-                init_transaction(tnum, transactions)
-                current_tx = tnum
-                merge_extra_info(gdata, current_tx, transactions)
-                transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(gdata))
-        titems_node = fragment.find('.//TicketItems')
-        if titems_node is not None and current_tx:
-            for iel in titems_node.findall('Item'):
-                pl = iel.get('PluCode', '')
-                dep = iel.get('DepCode', '')
-                try:
-                    qty = float(iel.get('Quantity', '1'))
-                except ValueError:
-                    qty = 1.0
-                try:
-                    price = float(iel.get('Price', '0'))
-                except ValueError:
-                    price = 0.0
-                try:
-                    rew_amt = float(iel.get('RewardAmount', '0'))
-                except ValueError:
-                    rew_amt = 0.0
-                if rew_amt == 0.0:
-                    rew_amt = price * qty
-                merged = False
-                for existing in transactions[current_tx]['items']:
-                    if existing.get('plu') == pl and existing.get('depCode') == dep:
-                        existing['qty'] += qty
-                        existing['amount'] += rew_amt
-                        merged = True
-                        break
-                if not merged:
-                    transactions[current_tx]['items'].append({
-                        'plu': pl,
-                        'name': '',
-                        'depCode': dep,
-                        'qty': qty,
-                        'price': price,
-                        'amount': rew_amt,
-                        'raw': etree.tostring(iel, encoding='unicode')
-                    })
-            merge_extra_info(titems_node, current_tx, transactions)
-            transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(titems_node))
-        loyalty = fragment.find('.//LoyaltyInfo')
-        if loyalty is not None and current_tx:
-            parse_loyalty_xml(loyalty, transactions[current_tx]['loyalty_info'])
-            transactions[current_tx]['loyalty_summary'] = etree.tostring(loyalty, encoding='unicode')
-        merge_extra_info(fragment, current_tx, transactions)
-        transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(fragment))
-
-    # ----- Branch: Membership updates (AddMmbrCard, AddMmbrInfo) -----
-    elif method in ('AddMmbrCard', 'AddMmbrInfo') and current_tx:
-        loyalty = fragment.find('.//LoyaltyInfo')
-        if loyalty is not None:
-            parse_loyalty_xml(loyalty, transactions[current_tx]['loyalty_info'])
-            transactions[current_tx]['loyalty_summary'] = etree.tostring(loyalty, encoding='unicode')
-            merge_extra_info(loyalty, current_tx, transactions)
-            transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(loyalty))
-        else:
-            transactions[current_tx].setdefault('other_fragments', []).append({
-                'method': method,
-                'raw': etree.tostring(fragment, encoding='unicode')
-            })
-            merge_extra_info(fragment, current_tx, transactions)
-            transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(fragment))
-
-    # ----- Branch: Tenders and Documents -----
-    elif method in ('AddTender', 'AddDocument', 'AddDocument(Response)') and current_tx:
-        if method == 'AddTender':
-            tender_el = fragment.find('.//TenderInfo')
-            if tender_el is not None:
-                try:
-                    amount = float(tender_el.get('Amount', '0'))
-                except ValueError:
-                    amount = 0.0
-                transactions[current_tx]['tenders'].append({
-                    'tenderNo': tender_el.get('TenderNo'),
-                    'amount': amount,
-                    'tenderType': tender_el.get('TenderType') or ''
-                })
-                merge_extra_info(tender_el, current_tx, transactions)
-                transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(tender_el))
-        else:
-            docinfo = fragment.find('.//DocumentInfo')
-            if docinfo is not None:
-                for d in docinfo.findall('Document'):
-                    transactions[current_tx]['documents'].append({
-                        'documentType': d.get('DocumentType'),
-                        'barcode': d.get('Barcode'),
-                        'confirmationLevel': d.get('ConfirmationLevel'),
-                        'promotionId': d.get('PromotionId'),
-                        'description': d.get('PromotionDescription'),
-                        'raw': etree.tostring(d, encoding='unicode')
-                    })
-            docs_resp = fragment.find('.//Documents')
-            if docs_resp is not None:
-                for d in docs_resp.findall('Document'):
-                    transactions[current_tx]['documents'].append({
-                        'documentType': d.get('DocumentType'),
-                        'barcode': d.get('Barcode'),
-                        'confirmationLevel': d.get('ConfirmationLevel'),
-                        'promotionId': d.get('PromotionId'),
-                        'description': d.get('PromotionDescription'),
-                        'raw': etree.tostring(d, encoding='unicode')
-                    })
-            merge_extra_info(fragment, current_tx, transactions)
-            transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(fragment))
-
-    # ----- Branch: Triggered Promotions -----
-    elif method.startswith('GetTriggeredPromotions') and current_tx:
-        for dl in fragment.findall('.//DiscountLine'):
-            pn = dl.get('PromNumber')
-            if pn:
-                transactions[current_tx]['promotions'].add(pn)
-            transactions[current_tx].setdefault('promo_items', []).append(dict(dl.attrib))
-        merge_extra_info(fragment, current_tx, transactions)
-        transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(fragment))
-
-    # ----- Branch: Query (for requests) -----
-    elif method == 'Query' and current_tx:
-        query_elem = fragment.find('.//PromQuery')
-        if query_elem is not None:
-            transactions[current_tx].setdefault('queries', []).append(
-                etree.tostring(query_elem, encoding='unicode')
-            )
-        merge_extra_info(fragment, current_tx, transactions)
-        transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(fragment))
-
-    # ----- Branch: Loyalty Summary -----
-    elif method.startswith('GetLoyaltySummary') and current_tx:
-        loyalty_info = fragment.find('.//LoyaltyInfo')
-        if loyalty_info is not None:
-            parse_loyalty_xml(loyalty_info, transactions[current_tx]['loyalty_info'])
-            transactions[current_tx]['loyalty_summary'] = etree.tostring(loyalty_info, encoding='unicode')
-        merge_extra_info(fragment, current_tx, transactions)
-        transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(fragment))
-
-    # ----- Branch: Savers Summary -----
-    elif method.startswith('GetSaversSummary') and current_tx:
-        savers_info = etree.tostring(fragment, encoding='unicode')
-        transactions[current_tx]['savers_summary'] = savers_info
-        merge_extra_info(fragment, current_tx, transactions)
-        transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(fragment))
+def _fragment_text(fragment, fragment_raw):
+    """
+    Text of the whole fragment. Reuses the UTF-8 bytes already serialized for
+    duplicate detection instead of walking the tree a second time.
+    """
+    if fragment_raw is not None:
+        return fragment_raw.decode('utf-8')
+    return etree.tostring(fragment, encoding='unicode')
 
-    # ----- Catch-all -----
-    else:
-        if current_tx:
-            transactions[current_tx].setdefault('other_fragments', []).append({
-                'method': method,
-                'raw': etree.tostring(fragment, encoding='unicode')
-            })
-            merge_extra_info(fragment, current_tx, transactions)
-            transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(fragment))
+def _merge_loyalty(rec, loyalty):
+    """
+    Parses a <LoyaltyInfo> into rec.loyalty_info and keeps its text as the
+    latest loyalty_summary. The text is taken now: iterparse_prom_xml clears
+    the element once its <LPE> has been processed.
+    """
+    parse_loyalty_xml(loyalty, rec.loyalty_info)
+    rec.loyalty_summary = etree.tostring(loyalty, encoding='unicode')
 
-    # ----- Promotion Details (if found anywhere) -----
-    promo_details = fragment.find('.//PromotionDetails')
+def _merge_promotion_details(fragment, transactions, current_tx):
+    """Collects a <PromotionDetails> found anywhere in the fragment; returns current_tx."""
+    promo_details = _first_descendant(fragment, 'PromotionDetails')
     if promo_details is not None and current_tx:
         details = dict(promo_details.attrib)
         seg_elem = promo_details.find('Segments')
         if seg_elem is not None:
             details['segments'] = [etree.tostring(child, encoding='unicode') for child in seg_elem]
-        transactions[current_tx]['promotion_details'].append(details)
+        rec = transactions[current_tx]
+        rec.promotion_details.append(details)
         merge_extra_info(promo_details, current_tx, transactions)
-        transactions[current_tx]['raw_fragment_attributes'].append(extract_all_attributes(promo_details))
+        _capture_attributes(rec, promo_details)
     return current_tx
 
+def _h_set_param(fragment, method, transactions, current_tx, fragment_raw):
+    """SetParam: opens the transaction named by SystemParameters/@TicketNumber."""
+    sysparams = _first_descendant(fragment, 'SystemParameters')
+    if sysparams is not None:
+        txid = sysparams.get('TicketNumber')
+        if txid:
+            init_transaction(txid, transactions)
+            rec = transactions[txid]
+            rec.storeID = sysparams.get('StoreID')
+            rec.cashierID = sysparams.get('CashierID')
+            merge_extra_info(sysparams, txid, transactions)
+            current_tx = txid
+            _capture_attributes(rec, sysparams)
+            rec.other_fragments.append({
+                'method': method,
+                'raw': etree.tostring(sysparams, encoding='unicode')
+            })
+            return current_tx
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _h_init(fragment, method, transactions, current_tx, fragment_raw):
+    if not current_tx:
+        return current_tx
+    rec = transactions[current_tx]
+    init_info = _first_descendant(fragment, 'InitInfo')
+    if init_info is not None:
+        rec.init_info = dict(init_info.attrib)
+        active_devices = _first_descendant(init_info, 'ActiveDevices')
+        if active_devices is not None:
+            devices = [dict(ad.attrib) for ad in active_devices.findall('ActiveDevice')]
+            rec.active_devices = devices
+        merge_extra_info(init_info, current_tx, transactions)
+        _capture_attributes(rec, init_info)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _h_add_item(fragment, method, transactions, current_tx, fragment_raw):
+    if not current_tx:
+        return current_tx
+    item_info = _first_descendant(fragment, 'ItemInfo')
+    if item_info is not None:
+        rec = transactions[current_tx]
+        _add_item(rec, item_info)
+        merge_extra_info(item_info, current_tx, transactions)
+        _capture_attributes(rec, item_info)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _add_item(rec, item_info):
+    """
+    Adds an <ItemInfo> to rec.items, or adds its quantity and amount to the
+    item already stored under the same key. The item record (and its raw
+    text) is only built for a new key.
+    """
+    attrs = item_info.attrib  # bound once for the attribute reads below
+    key = get_item_key(attrs)
+    qty_val, amt_val, base_price, qip_val = _floats(attrs, _ITEM_INFO_FLOATS)
+    idx = rec.item_keys.get(key)
+    if idx is not None:
+        existing = rec.items[idx]
+        existing['qty'] += qty_val
+        existing['amount'] += amt_val
+        logger.debug("Merged item with key %s (PLU %s) in transaction %s",
+                     key, attrs.get('PluCode', ''), rec.trans_id)
+        return
+    prices_el = item_info.find('.//Prices/Price')
+    if prices_el is not None:
+        try:
+            subprice_val = float(prices_el.get('Price', '0'))
+        except ValueError:
+            subprice_val = base_price
+    else:
+        subprice_val = base_price
+    plu = attrs.get('PluCode', '')
+    rec.item_keys[key] = len(rec.items)
+    rec.items.append({
+        'plu': plu,
+        'name': attrs.get('Name', '').strip(),
+        'depCode': attrs.get('DepCode', ''),
+        'posSequence': attrs.get('PosSequence', None),
+        'qty': qty_val,
+        'price': subprice_val,
+        'amount': amt_val,
+        'quantity_in_price': qip_val,
+        'raw': etree.tostring(item_info, encoding='unicode'),
+        'key': key
+    })
+    logger.debug("Added new item with key %s (PLU %s) in transaction %s", key, plu, rec.trans_id)
+
+def _h_query_response(fragment, method, transactions, current_tx, fragment_raw):
+    """Query(Response): may also open the transaction (GeneralData/@TicketNumber)."""
+    gdata = _first_descendant(fragment, 'GeneralData')
+    if gdata is not None:
+        tnum = gdata.get('TicketNumber')
+        if tnum:
+            init_transaction(tnum, transactions)
+            current_tx = tnum
+            merge_extra_info(gdata, current_tx, transactions)
+            _capture_attributes(transactions[current_tx], gdata)
+    titems_node = _first_descendant(fragment, 'TicketItems')
+    if titems_node is not None and current_tx:
+        items = transactions[current_tx].items
+        # Index of the first item per (plu, depCode): the key items are merged on.
+        first_by_key = {}
+        for idx, existing in enumerate(items):
+            first_by_key.setdefault((existing.get('plu'), existing.get('depCode')), idx)
+        for iel in titems_node.findall('Item'):
+            attrs = iel.attrib
+            pl = attrs.get('PluCode', '')
+            dep = attrs.get('DepCode', '')
+            qty, price, rew_amt = _floats(attrs, _TICKET_ITEM_FLOATS)
+            if rew_amt == 0.0:
+                rew_amt = price * qty
+            idx = first_by_key.get((pl, dep))
+            if idx is not None:
+                existing = items[idx]
+                existing['qty'] += qty
+                existing['amount'] += rew_amt
+            else:
+                first_by_key[(pl, dep)] = len(items)
+                items.append({
+                    'plu': pl,
+                    'name': '',
+                    'depCode': dep,
+                    'qty': qty,
+                    'price': price,
+                    'amount': rew_amt,
+                    'raw': etree.tostring(iel, encoding='unicode')
+                })
+        merge_extra_info(titems_node, current_tx, transactions)
+        _capture_attributes(transactions[current_tx], titems_node)
+    loyalty = _first_descendant(fragment, 'LoyaltyInfo')
+    if loyalty is not None and current_tx:
+        _merge_loyalty(transactions[current_tx], loyalty)
+    merge_extra_info(fragment, current_tx, transactions)
+    _capture_attributes(transactions[current_tx], fragment)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _h_membership(fragment, method, transactions, current_tx, fragment_raw):
+    """Membership updates (AddMmbrCard, AddMmbrInfo)."""
+    if not current_tx:
+        return current_tx
+    rec = transactions[current_tx]
+    loyalty = _first_descendant(fragment, 'LoyaltyInfo')
+    if loyalty is not None:
+        _merge_loyalty(rec, loyalty)
+        merge_extra_info(loyalty, current_tx, transactions)
+        _capture_attributes(rec, loyalty)
+    else:
+        rec.other_fragments.append({
+            'method': method,
+            'raw': _fragment_text(fragment, fragment_raw)
+        })
+        merge_extra_info(fragment, current_tx, transactions)
+        _capture_attributes(rec, fragment)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _h_add_tender(fragment, method, transactions, current_tx, fragment_raw):
+    if not current_tx:
+        return current_tx
+    rec = transactions[current_tx]
+    tender_el = _first_descendant(fragment, 'TenderInfo')
+    if tender_el is not None:
+        attrs = tender_el.attrib
+        try:
+            amount = float(attrs.get('Amount', '0'))
+        except ValueError:
+            amount = 0.0
+        rec.tenders.append({
+            'tenderNo': attrs.get('TenderNo'),
+            'amount': amount,
+            'tenderType': attrs.get('TenderType') or ''
+        })
+        merge_extra_info(tender_el, current_tx, transactions)
+        _capture_attributes(rec, tender_el)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _document_record(d):
+    """Record of one <Document> of AddDocument / AddDocument(Response)."""
+    attrs = d.attrib
+    return {
+        'documentType': attrs.get('DocumentType'),
+        'barcode': attrs.get('Barcode'),
+        'confirmationLevel': attrs.get('ConfirmationLevel'),
+        'promotionId': attrs.get('PromotionId'),
+        'description': attrs.get('PromotionDescription'),
+        'raw': etree.tostring(d, encoding='unicode')
+    }
+
+def _h_add_document(fragment, method, transactions, current_tx, fragment_raw):
+    """AddDocument and AddDocument(Response)."""
+    if not current_tx:
+        return current_tx
+    rec = transactions[current_tx]
+    docinfo = _first_descendant(fragment, 'DocumentInfo')
+    if docinfo is not None:
+        for d in docinfo.findall('Document'):
+            rec.documents.append(_document_record(d))
+    docs_resp = _first_descendant(fragment, 'Documents')
+    if docs_resp is not None:
+        for d in docs_resp.findall('Document'):
+            rec.documents.append(_document_record(d))
+    merge_extra_info(fragment, current_tx, transactions)
+    _capture_attributes(rec, fragment)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _h_triggered_promotions(fragment, method, transactions, current_tx, fragment_raw):
+    if not current_tx:
+        return current_tx
+    rec = transactions[current_tx]
+    for dl in fragment.iterdescendants('DiscountLine'):
+        pn = dl.get('PromNumber')
+        if pn:
+            rec.promotions.add(pn)
+        rec.promo_items.append(dict(dl.attrib))
+    merge_extra_info(fragment, current_tx, transactions)
+    _capture_attributes(rec, fragment)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _h_query(fragment, method, transactions, current_tx, fragment_raw):
+    """Query (requests)."""
+    if not current_tx:
+        return current_tx
+    rec = transactions[current_tx]
+    query_elem = _first_descendant(fragment, 'PromQuery')
+    if query_elem is not None:
+        rec.queries.append(
+            etree.tostring(query_elem, encoding='unicode')
+        )
+    merge_extra_info(fragment, current_tx, transactions)
+    _capture_attributes(rec, fragment)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _h_loyalty_summary(fragment, method, transactions, current_tx, fragment_raw):
+    if not current_tx:
+        return current_tx
+    rec = transactions[current_tx]
+    loyalty_info = _first_descendant(fragment, 'LoyaltyInfo')
+    if loyalty_info is not None:
+        _merge_loyalty(rec, loyalty_info)
+    merge_extra_info(fragment, current_tx, transactions)
+    _capture_attributes(rec, fragment)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _h_savers_summary(fragment, method, transactions, current_tx, fragment_raw):
+    if not current_tx:
+        return current_tx
+    rec = transactions[current_tx]
+    savers_info = _fragment_text(fragment, fragment_raw)
+    rec.savers_summary = savers_info
+    merge_extra_info(fragment, current_tx, transactions)
+    _capture_attributes(rec, fragment)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+def _h_other(fragment, method, transactions, current_tx, fragment_raw):
+    """Catch-all for any other method."""
+    if current_tx:
+        rec = transactions[current_tx]
+        rec.other_fragments.append({
+            'method': method,
+            'raw': _fragment_text(fragment, fragment_raw)
+        })
+        merge_extra_info(fragment, current_tx, transactions)
+        _capture_attributes(rec, fragment)
+    return _merge_promotion_details(fragment, transactions, current_tx)
+
+# LPE Method -> handler(fragment, method, transactions, current_tx, fragment_raw) -> current_tx
+_METHOD_HANDLERS = {
+    'SetParam': _h_set_param,
+    'Init': _h_init,
+    'AddItem': _h_add_item,
+    'Query(Response)': _h_query_response,
+    'AddMmbrCard': _h_membership,
+    'AddMmbrInfo': _h_membership,
+    'AddTender': _h_add_tender,
+    'AddDocument': _h_add_document,
+    'AddDocument(Response)': _h_add_document,
+    'Query': _h_query,
+}
+# Methods matched by prefix (e.g. 'GetTriggeredPromotions(Response)')
+_PREFIX_HANDLERS = (
+    ('GetTriggeredPromotions', _h_triggered_promotions),
+    ('GetLoyaltySummary', _h_loyalty_summary),
+    ('GetSaversSummary', _h_savers_summary),
+)
+
+def process_lpe_fragment(fragment, method, transactions, current_tx=None):
+    # The same few Method values recur for every <LPE>; share one string per value.
+    method = intern(method or '')
+    # Compute a hash for this fragment so that duplicates are skipped. Duplicates are
+    # tracked per transaction, so without a current one there is nothing to hash.
+    fragment_raw = None
+    if current_tx:
+        fragment_raw = etree.tostring(fragment, encoding='utf-8') # type: ignore
+        frag_hash = _digest(fragment_raw)
+        processed = transactions[current_tx].processed_fragments
+        if frag_hash in processed:
+            logger.debug(f"Skipping duplicate fragment with hash {frag_hash} in transaction {current_tx}")
+            return current_tx
+        processed.add(frag_hash)
+
+    # Dispatch on the LPE Method
+    handler = _METHOD_HANDLERS.get(method)
+    if handler is None:
+        handler = _h_other
+        for prefix, prefix_handler in _PREFIX_HANDLERS:
+            if method.startswith(prefix):
+                handler = prefix_handler
+                break
+    return handler(fragment, method, transactions, current_tx, fragment_raw)
+
 ###############################################################################
 # 6) Revised prom*.xml parser with enhanced time parsing
 ###############################################################################
 def parse_prom_log(filepath, transactions=None):
     """
     Parse a prom*.xml file by:
-      - Reading the file and cleaning XML declarations,
-      - Wrapping it in a synthetic root (<Logs>),
-      - Extracting a session start time (if available from <Session>/<StartTime>),
+      - Streaming its <LPE> elements (iterparse_prom_xml),
       - Processing each <LPE> element,
-      - And if a session start time is found, storing it in the transaction record.
+      - Extracting a session start time (from <Session>/<StartTime>, <Customer>
+        or <GeneralData>, seen while streaming),
+      - And if a session start time is found, storing it in the transaction
+        records touched by this file that have no transaction_time yet.
     """
     if transactions is None:
         transactions = {}
-    with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-        content = f.read()
-    content = clean_xml_declarations(content)
-    wrapped = "<Logs>\n" + content + "\n</Logs>"
-    try:
-        parser = etree.XMLParser(recover=True, remove_blank_text=True)
-        root = etree.fromstring(wrapped.encode('utf-8'), parser=parser)
-    except etree.XMLSyntaxError as e:
-        logger.error(f"Error parsing wrapped XML: {e}")
-        return transactions
-
-    # Extract a timestamp from the XML tree (try several locations)
-    session_dt = extract_timestamp(root)
+    stamps = {}
+    touched = set()
+    current_ticket = None
+    for lpe_elem in iterparse_prom_xml(filepath, stamps):
+        method = lpe_elem.get('Method')
+        current_ticket = process_lpe_fragment(lpe_elem, method, transactions, current_ticket)
+        if current_ticket:
+            touched.add(current_ticket)
+
+    # Extract a timestamp from the streamed elements (try several locations)
+    session_dt = timestamp_from_attrs(stamps.get('StartTime'), stamps.get('Customer'),
+                                      stamps.get('GeneralData'))
     if session_dt:
         logger.debug(f"Extracted session timestamp: {session_dt.isoformat()}")
+        for txid in touched:
+            if transactions[txid].transaction_time is None:
+                transactions[txid].transaction_time = session_dt
     else:
         logger.debug("No timestamp could be extracted from the XML.")
 
-    current_ticket = None
-    for lpe_elem in root.findall('.//LPE'):
-        method = lpe_elem.get('Method')
-        current_ticket = process_lpe_fragment(lpe_elem, method, transactions, current_ticket)
-        # If we have a session start time and no transaction_time yet, update it.
-        if current_ticket and session_dt and transactions[current_ticket].get('transaction_time') is None:
-            transactions[current_ticket]['transaction_time'] = session_dt
-
     return transactions
 
 ###############################################################################
 # 7) Loyalty Sub-parsing helpers (unchanged)
 ###############################################################################
 def parse_loyalty_balances(root, aggregator):
-    for b in root.findall('.//Balance'):
+    for b in root.iterdescendants('Balance'):
         aggregator['balances'].append({
             'type': b.get('Type'),
             'balance_id': b.get('ID'),
@@ -502,7 +704,7 @@ def parse_loyalty_balances(root, aggregator):
             'redemptions': b.get('Redemptions'),
             'current_balance': b.get('CurrentBalance'),
         })
-    for a in root.findall('.//Acc'):
+    for a in root.iterdescendants('Acc'):
         aggregator['accounts'].append({
             'acc_id': a.get('ID'),
             'earn_value': a.get('EarnValue'),
@@ -512,7 +714,7 @@ def parse_loyalty_balances(root, aggregator):
         })
 
 def parse_loyalty_members(root, aggregator):
-    for m in root.findall('.//Member'):
+    for m in root.iterdescendants('Member'):
         aggregator['members'].append({
             'last_name': m.get('LastName'),
             'first_name': m.get('FirstName'),
@@ -523,6 +725,6 @@ def parse_loyalty_members(root, aggregator):
 def parse_loyalty_xml(fragment, aggregator):
     parse_loyalty_balances(fragment, aggregator)
     parse_loyalty_members(fragment, aggregator)
-    segments = fragment.findall('.//Segments/Segment') or fragment.findall('.//Seg')
+    segments = fragment.findall('.//Segments/Segment') or fragment.iterdescendants('Seg')
     for seg in segments:
-        aggregator['segments'].append(seg.attrib)
+        aggregator['segments'].append(dict(seg.attrib))
@@ -1,44 +1,142 @@
 # log_parsers/log_parsers_iis.py
 
+import io
 import logging
 import re
-from datetime import datetime
+from datetime import datetime, time
 from dateutil import parser as date_parser
 
 logger = logging.getLogger('IISLogParser')  # pylint: disable=no-member
 logger.setLevel(logging.DEBUG)  # pylint: disable=no-member
 
-def parse_iis_log_generator(file_obj):
+# The zero-padded IIS shapes: "YYYY-MM-DD HH:MM:SS" (#Date header, date + time
+# fields), "YYYY-MM-DD" and "HH:MM:SS". They are built from their integer fields
+# without strptime; other shapes fall back to the general parsers.
+_DATETIME_RE = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})')
+_DATE_RE = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2})')
+_TIME_RE = re.compile(r'([0-9]{2}):([0-9]{2}):([0-9]{2})')
+
+def parse_header_date(date_str):
+    """datetime of a #Date header value; shapes other than the standard one go to dateutil."""
+    m = _DATETIME_RE.fullmatch(date_str)
+    if m is not None:
+        return datetime(*map(int, m.groups()))
+    return date_parser.parse(date_str)
+
+def parse_log_datetime(dt_str):
+    """datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")."""
+    m = _DATETIME_RE.fullmatch(dt_str)
+    if m is not None:
+        return datetime(*map(int, m.groups()))
+    return datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
+
+def parse_log_date(d_str):
+    """datetime.strptime(d_str, "%Y-%m-%d")."""
+    m = _DATE_RE.fullmatch(d_str)
+    if m is not None:
+        return datetime(*map(int, m.groups()))
+    return datetime.strptime(d_str, "%Y-%m-%d")
+
+def parse_log_time(t_str):
+    """datetime.strptime(t_str, "%H:%M:%S").time()."""
+    m = _TIME_RE.fullmatch(t_str)
+    if m is not None:
+        return time(*map(int, m.groups()))
+    return datetime.strptime(t_str, "%H:%M:%S").time()
+
+# #Fields names use '_' where IIS writes '-', '(' or ')' (cs(User-Agent) -> cs_User_Agent_)
+_FIELD_NAME_TRANS = str.maketrans({'-': '_', '(': '_', ')': '_'})
+
+# Header directives the parser acts on, keyed by their case-folded "#Name:" prefix
+_FIELDS = "fields"
+_DATE = "date"
+_DIRECTIVES = {"#fields:": _FIELDS, "#date:": _DATE}
+
+# One field of a data line: a run of non-blanks, where "quoted" parts may hold blanks.
+# Unquoted text is taken a run at a time; an unpaired '"' is kept as a plain character.
+_FIELD_RE = re.compile(r'(?:[^\s"]+|"[^"]*"|")+')
+
+# Read buffer for IIS log files (the 8 KB default costs a read per few dozen lines)
+IIS_READ_BUFFER_SIZE = 1 << 16
+
+# Rows per list yielded by parse_iis_log_batches
+IIS_BATCH_SIZE = 1024
+
+# Entries kept per timestamp cache before it is emptied (bounds memory on huge files)
+TS_CACHE_MAX = 100_000
+
+def parse_iis_log_generator(file_obj, keep_raw=True):
     """
     Generator that parses an IIS log file line by line.
     Yields dictionaries representing each log entry.
+    Arguments are those of parse_iis_log_batches.
     """
+    for batch in parse_iis_log_batches(file_obj, keep_raw=keep_raw):
+        yield from batch
+
+def parse_iis_log_batches(file_obj, keep_raw=True, batch_size=IIS_BATCH_SIZE):
+    """
+    Generator that parses an IIS log file line by line.
+    Yields lists of up to batch_size dictionaries, one per log entry, in file order
+    (one generator switch per batch rather than per row).
+    'file_obj' should be a text file opened with buffering=IIS_READ_BUFFER_SIZE;
+    a binary stream is wrapped here (buffered, UTF-8 with replacement).
+    With keep_raw=False the rows carry raw_line=None instead of the stripped line,
+    so callers that only need the fields do not hold a second copy of each line.
+    """
+    if isinstance(file_obj, io.RawIOBase):
+        file_obj = io.BufferedReader(file_obj, buffer_size=IIS_READ_BUFFER_SIZE)
+    if isinstance(file_obj, io.BufferedIOBase):
+        file_obj = io.TextIOWrapper(file_obj, encoding="utf-8", errors="replace")
     logger.info("Starting IIS log parsing.")
+    batch = []
     
     try:
-        field_list = []
+        field_list = ()
+        n_fields = 0
+        row_keys = ()  # field_list + the two keys the parser adds to every row
+        date_idx = time_idx = -1  # positions of the date/time fields (-1: absent)
         current_date_for_time = None
+        today = datetime.now().date()  # date of time-only stamps while no #Date applies
         min_time = None
         max_time = None
+        # Parsed timestamps by raw value: IIS lines share the same date/second many times over.
+        ts_cache = {}       # "date time" -> ts
+        time_ts_cache = {}  # time -> ts (on current_date_for_time)
+        date_ts_cache = {}  # date -> ts
+        split_fields = _FIELD_RE.findall  # bound once for the data-line loop (quoted lines)
 
         for line_num, line in enumerate(file_obj, start=1):
+            # strip(), not rstrip(): the '#' directive test and raw_line expect
+            # leading blanks to be gone as well
             line = line.strip()
             if not line:
                 continue
 
-            # Handle comments and metadata
-            if line.startswith("#"):
-                if line.lower().startswith("#fields:"):
+            # Handle comments and metadata: the directive name up to its ':' is
+            # looked up as a whole (only that name is case-folded)
+            if line[0] == "#":
+                colon = line.find(":")
+                directive = _DIRECTIVES.get(line[:colon + 1].lower())
+                if directive == _FIELDS:
                     # Example: "#Fields: date time s-ip cs-method cs-uri-stem ..."
-                    fields_line = line.split(":", 1)[1].strip()
+                    fields_line = line[colon + 1:].strip()
                     # Replace hyphens and parentheses with underscores for consistency
-                    field_list = [re.sub(r'[\-()]', '_', field) for field in fields_line.split()]
+                    field_list = tuple(field.translate(_FIELD_NAME_TRANS) for field in fields_line.split())
+                    # Last position per name, matching the row dict (a repeated name keeps its last value)
+                    field_pos = {name: i for i, name in enumerate(field_list)}
+                    n_fields = len(field_list)
+                    # Fixed for the rest of the section, so kept as tuples
+                    row_keys = field_list + ("combined_ts", "raw_line")
+                    date_idx = field_pos.get("date", -1)
+                    time_idx = field_pos.get("time", -1)
                     logger.debug(f"Fields parsed on line {line_num}: {field_list}")
-                elif line.lower().startswith("#date:"):
+                elif directive == _DATE:
                     # Example: "#Date: 2025-01-08 03:15:51"
-                    date_str = line.split(":", 1)[1].strip()
+                    date_str = line[colon + 1:].strip()
+                    time_ts_cache.clear()  # time-only stamps are relative to this date
                     try:
-                        dt = date_parser.parse(date_str)
+                        dt = parse_header_date(date_str)
                         current_date_for_time = dt
                         logger.debug(f"Current date for time set to: {current_date_for_time}")
                     except Exception as e:
@@ -52,79 +150,101 @@ def parse_iis_log_generator(file_obj):
                 logger.warning(f"No #Fields line found before data on line {line_num}. Skipping line.")
                 continue
 
-            # Split the line into parts, considering quoted fields
-            parts = re.findall(r'(?:"[^"]*"|\S)+', line)
-            if len(parts) < len(field_list):
-                # Append '-' for missing fields
-                parts += ['-'] * (len(field_list) - len(parts))
-                logger.warning(f"Line {line_num} has fewer fields ({len(parts)}) than expected ({len(field_list)}). Appending '-' for missing fields.")
-            elif len(parts) > len(field_list):
-                # Trim extra fields
-                parts = parts[:len(field_list)]
-                logger.warning(f"Line {line_num} has more fields ({len(parts)}) than expected ({len(field_list)}). Trimming extra fields.")
-
-            # Build a dict for this log line with underscore-based keys
-            row_dict = {}
-            for col_name, value in zip(field_list, parts):
-                row_dict[col_name] = value
-
-            # Attempt to build timestamp
+            # Split the line into parts, considering quoted fields (most lines have
+            # none, and without a '"' the regex splits exactly like str.split())
+            if '"' in line:
+                parts = split_fields(line)
+            else:
+                parts = line.split()
+            n_parts = len(parts)
+            if n_parts != n_fields:
+                if n_parts < n_fields:
+                    # Append '-' for missing fields
+                    parts += ['-'] * (n_fields - n_parts)
+                    logger.warning(f"Line {line_num} has fewer fields ({len(parts)}) than expected ({n_fields}). Appending '-' for missing fields.")
+                else:
+                    # Trim extra fields
+                    parts = parts[:n_fields]
+                    logger.warning(f"Line {line_num} has more fields ({len(parts)}) than expected ({n_fields}). Trimming extra fields.")
+
+            # Attempt to build timestamp (the date/time fields are read by position)
             combined_ts = None
 
-            if "date" in field_list and "time" in field_list:
-                d = row_dict.get("date", "")
-                t = row_dict.get("time", "")
+            if date_idx >= 0 and time_idx >= 0:
+                d = parts[date_idx]
+                t = parts[time_idx]
                 if d and t:
-                    try:
-                        dt_str = f"{d} {t}"
-                        combined_dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
-                        combined_ts = combined_dt.timestamp()
-                        logger.debug(f"Timestamp parsed from date and time on line {line_num}: {combined_ts}")
-                    except ValueError as ve:
-                        combined_ts = None
-                        logger.warning(f"Failed to parse datetime on line {line_num}: {ve}")
-            elif "time" in field_list:
-                t_str = row_dict.get("time", "")
+                    dt_str = f"{d} {t}"
+                    combined_ts = ts_cache.get(dt_str)
+                    if combined_ts is None:
+                        try:
+                            combined_dt = parse_log_datetime(dt_str)
+                            combined_ts = combined_dt.timestamp()
+                            if len(ts_cache) >= TS_CACHE_MAX:
+                                ts_cache.clear()
+                            ts_cache[dt_str] = combined_ts
+                        except ValueError as ve:
+                            combined_ts = None
+                            logger.warning(f"Failed to parse datetime on line {line_num}: {ve}")
+            elif time_idx >= 0:
+                t_str = parts[time_idx]
                 if t_str:
-                    try:
-                        t_obj = datetime.strptime(t_str, "%H:%M:%S").time()
-                        if current_date_for_time:
-                            combined_dt = datetime.combine(current_date_for_time.date(), t_obj) # type: ignore
-                        else:
-                            combined_dt = datetime.combine(datetime.now().date(), t_obj)
-                        combined_ts = combined_dt.timestamp()
-                        logger.debug(f"Timestamp parsed from time on line {line_num}: {combined_ts}")
-                    except ValueError as ve:
-                        combined_ts = None
-                        logger.warning(f"Failed to parse time on line {line_num}: {ve}")
-            elif "date" in field_list:
-                d_str = row_dict.get("date", "")
+                    combined_ts = time_ts_cache.get(t_str)
+                    if combined_ts is None:
+                        try:
+                            t_obj = parse_log_time(t_str)
+                            if current_date_for_time:
+                                combined_dt = datetime.combine(current_date_for_time.date(), t_obj) # type: ignore
+                            else:
+                                combined_dt = datetime.combine(today, t_obj)
+                            combined_ts = combined_dt.timestamp()
+                            if len(time_ts_cache) >= TS_CACHE_MAX:
+                                time_ts_cache.clear()
+                            time_ts_cache[t_str] = combined_ts
+                        except ValueError as ve:
+                            combined_ts = None
+                            logger.warning(f"Failed to parse time on line {line_num}: {ve}")
+            elif date_idx >= 0:
+                d_str = parts[date_idx]
                 if d_str:
-                    try:
-                        combined_dt = datetime.strptime(d_str, "%Y-%m-%d")
-                        combined_ts = combined_dt.timestamp()
-                        logger.debug(f"Timestamp parsed from date on line {line_num}: {combined_ts}")
-                    except ValueError as ve:
-                        combined_ts = None
-                        logger.warning(f"Failed to parse date on line {line_num}: {ve}")
+                    combined_ts = date_ts_cache.get(d_str)
+                    if combined_ts is None:
+                        try:
+                            combined_dt = parse_log_date(d_str)
+                            combined_ts = combined_dt.timestamp()
+                            if len(date_ts_cache) >= TS_CACHE_MAX:
+                                date_ts_cache.clear()
+                            date_ts_cache[d_str] = combined_ts
+                        except ValueError as ve:
+                            combined_ts = None
+                            logger.warning(f"Failed to parse date on line {line_num}: {ve}")
 
             if combined_ts:
-                # Update min_time and max_time
-                if min_time is None or combined_ts < min_time:
+                # Update min_time and max_time (both are set by the first timestamp)
+                if min_time is None:
+                    min_time = max_time = combined_ts
+                elif combined_ts < min_time:
                     min_time = combined_ts
-                    logger.debug(f"Updated min_time to: {min_time}")
-                if max_time is None or combined_ts > max_time:
+                elif combined_ts > max_time:
                     max_time = combined_ts
-                    logger.debug(f"Updated max_time to: {max_time}")
-
-                row_dict["combined_ts"] = combined_ts
             else:
-                row_dict["combined_ts"] = None
+                combined_ts = None
 
-            # Add raw_line for full log line
-            row_dict["raw_line"] = line
+            # Build a dict for this log line with underscore-based keys, plus
+            # combined_ts and raw_line (the full log line, if kept), in one pass
+            parts.append(combined_ts)
+            parts.append(line if keep_raw else None)
+            batch.append(dict(zip(row_keys, parts)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
 
-            yield row_dict
+        # One summary per file (no per-line debug logging in the loop)
+        logger.debug(f"Finished IIS log parsing; timestamps range from {min_time} to {max_time}.")
 
     except Exception as e:
         logger.error(f"Error parsing IIS log: {e}")
+
+    # Rows parsed before the end of the file (or an error) still reach the caller
+    if batch:
+        yield batch
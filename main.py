@@ -2,6 +2,7 @@
 
 import sys
 import logging
+import multiprocessing
 
 def exception_hook(exc_type, exc_value, exc_traceback):
     logging.critical("Uncaught exception", exc_info=(exc_type, exc_value, exc_traceback)) #pylint: disable=no-member
@@ -9,14 +10,16 @@ def exception_hook(exc_type, exc_value, exc_traceback):
 
 sys.excepthook = exception_hook
 
-from PyQt5.QtWidgets import QApplication
-from ui.main_window import MainWindow
-import qdarkstyle
-
 from services.logging.logging_config import setup_logging
 
 
 def main():
+    # GUI imports live here: spawned parser processes re-import this module
+    # as __mp_main__ and have no use for Qt or the UI package
+    from PyQt5.QtWidgets import QApplication
+    from ui.main_window import MainWindow
+    import qdarkstyle
+
     setup_logging()
     logger = logging.getLogger('Main')
     logger.info("Starting Log Dashboard application.")
@@ -30,4 +33,6 @@ def main():
     sys.exit(exit_code)
 
 if __name__ == "__main__":
+    # Required for the parser process pools in a frozen (PyInstaller) build
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -1,13 +1,25 @@
 # services/analyze/iis_analyze.py
 
 import os
-from datetime import datetime
 import pandas as pd
 from collections import defaultdict
 import logging
 import numpy as np
 import xlsxwriter  # Ensure you have xlsxwriter installed
 
+# Rows per DataFrame when a log is read for analysis (larger chunks, or reading a
+# whole file at once, measured no faster with the C reader and vectorized parsing)
+IIS_ANALYZE_CHUNKSIZE = 100_000
+
+def _sum_value_counts(counts_by_chunk):
+    """
+    Sums per-chunk value_counts Series into one Series per label, sorted by label
+    (all NaN labels are counted together). Empty Series if there are no chunks.
+    """
+    if not counts_by_chunk:
+        return pd.Series(dtype='int')
+    return pd.concat(counts_by_chunk).groupby(level=0, dropna=False).sum().rename(None)
+
 class IISLogAnalyzer:
     """
     Class to analyze IIS logs and export reports to Excel.
@@ -25,20 +37,10 @@ class IISLogAnalyzer:
         else:
             self.logger = logger
 
-    def parse_datetime(self, row):
-        """
-        Combine 'date' and 'time' columns into a datetime object if possible.
-        """
-        try:
-            return datetime.strptime(f"{row['date']} {row['time']}", '%Y-%m-%d %H:%M:%S')
-        except (ValueError, TypeError):
-            self.logger.warning(f"Failed to parse datetime for row: {row}")
-            return None
-
     def load_log_file_in_chunks(
         self,
         log_file_path,
-        chunksize=100000,
+        chunksize=IIS_ANALYZE_CHUNKSIZE,
         interruption_flag=None,
         progress_callback=None,
         selected_columns=None
@@ -58,7 +60,6 @@ class IISLogAnalyzer:
         """
         self.logger.debug(f"Loading log file in chunks: {log_file_path}")
         columns_line = []
-        bytes_columns_present = True  # Flag to determine if 'sc-bytes' and 'cs-bytes' are present
         chunk_number = 0  # To track progress
 
         # Try to find the "#Fields:" line to get column names
@@ -82,7 +83,29 @@ class IISLogAnalyzer:
                 progress_callback(f"No #Fields: line found in {log_file_path}. Skipping.")
             return
 
-        # Now read the file in chunks using those columns
+        # Every chunk has the #Fields columns, so what to convert is decided once per file
+        numeric_cols = []
+        for col in ['sc-status', 'time-taken', 'sc-bytes', 'cs-bytes']:
+            if col in columns_line:
+                numeric_cols.append(col)
+            elif col in ['sc-bytes', 'cs-bytes']:
+                self.logger.warning(f"Column '{col}' not found in {log_file_path}. Skipping byte columns.")
+                if progress_callback:
+                    progress_callback(f"Column '{col}' not found. Skipping related analyses.")
+            else:
+                self.logger.warning(f"Column '{col}' not found in {log_file_path}.")
+                if progress_callback:
+                    progress_callback(f"Column '{col}' not found in {log_file_path}.")
+        has_date_time = 'date' in columns_line and 'time' in columns_line
+        if not has_date_time:
+            self.logger.warning(f"Missing 'date' or 'time' columns in {log_file_path}.")
+            if progress_callback:
+                progress_callback(f"Missing 'date' or 'time' columns in {log_file_path}.")
+        has_time_taken = 'time-taken' in columns_line
+
+        # Now read the file in chunks using those columns. Every column is kept: the
+        # slowest rows go to the SlowRequests sheet whole. (pyarrow's CSV reader has
+        # no comment-line option, so the '#' directives between entries rule it out.)
         try:
             for chunk in pd.read_csv(
                 log_file_path,
@@ -90,7 +113,8 @@ class IISLogAnalyzer:
                 names=columns_line,
                 comment='#',       # Ignore all lines that start with '#' after the fields
                 header=None,
-                engine='python',
+                engine='c',        # Same splitting, quoting and bad-line handling as 'python', in C
+                low_memory=False,  # Infer each column's type once per chunk
                 encoding='utf-8',
                 chunksize=chunksize,
                 on_bad_lines='skip'
@@ -104,41 +128,27 @@ class IISLogAnalyzer:
                         progress_callback("Analysis interrupted by the user.")
                     return  # Exit the generator
 
-                # Convert numeric columns if present
-                if bytes_columns_present:
-                    numeric_cols = ['sc-status', 'time-taken', 'sc-bytes', 'cs-bytes']
-                else:
-                    numeric_cols = ['sc-status', 'time-taken']  # Exclude bytes columns if not present
-
+                # Convert the numeric columns present in this file (text columns stay
+                # object dtype; each is counted once, so a category conversion would not pay off)
                 for col in numeric_cols:
-                    if col in chunk.columns:
-                        chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
-                        self.logger.debug(f"Converted column '{col}' to numeric in chunk {chunk_number}.")
-                    else:
-                        if col in ['sc-bytes', 'cs-bytes']:
-                            bytes_columns_present = False
-                            self.logger.warning(
-                                f"Column '{col}' not found in {log_file_path} chunk {chunk_number}. "
-                                "Skipping byte columns for future chunks."
-                            )
-                            if progress_callback:
-                                progress_callback(f"Column '{col}' not found. Skipping related analyses.")
-                        else:
-                            self.logger.warning(f"Column '{col}' not found in {log_file_path} chunk {chunk_number}.")
-                            if progress_callback:
-                                progress_callback(f"Column '{col}' not found in chunk {chunk_number}.")
-
-                # Create combined datetime
-                if 'date' in chunk.columns and 'time' in chunk.columns:
-                    chunk['datetime'] = chunk.apply(self.parse_datetime, axis=1)
+                    chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+                    self.logger.debug(f"Converted column '{col}' to numeric in chunk {chunk_number}.")
+
+                # Create combined datetime (one vectorized parse; bad values become NaT)
+                if has_date_time:
+                    chunk['datetime'] = pd.to_datetime(
+                        chunk['date'].astype(str) + ' ' + chunk['time'].astype(str),
+                        format='%Y-%m-%d %H:%M:%S',
+                        errors='coerce',
+                        cache=True
+                    )
+                    failed = int(chunk['datetime'].isna().sum())
+                    if failed:
+                        self.logger.warning(f"Failed to parse datetime for {failed} rows in chunk {chunk_number}.")
                     self.logger.debug(f"Created 'datetime' column in chunk {chunk_number}.")
-                else:
-                    self.logger.warning(f"Missing 'date' or 'time' columns in chunk {chunk_number}.")
-                    if progress_callback:
-                        progress_callback(f"Missing 'date' or 'time' columns in chunk {chunk_number}.")
 
                 # Rename 'time-taken' to 'time_taken_ms' for clarity
-                if 'time-taken' in chunk.columns:
+                if has_time_taken:
                     chunk.rename(columns={'time-taken': 'time_taken_ms'}, inplace=True)
                     self.logger.debug(f"Renamed 'time-taken' to 'time_taken_ms' in chunk {chunk_number}.")
 
@@ -317,8 +327,11 @@ class IISLogAnalyzer:
 
         # Initialize aggregation variables
         total_requests = 0
-        requests_by_method = pd.Series(dtype='int')
-        requests_by_status = pd.Series(dtype='int')
+        # Per-chunk value_counts, summed once after the last chunk (see _sum_value_counts)
+        method_counts_by_chunk = []
+        status_counts_by_chunk = []
+        ip_counts_by_chunk = []
+        uri_counts_by_chunk = []
         slow_requests_count = 0
         df_4xx_count = 0
         df_5xx_count = 0
@@ -327,8 +340,8 @@ class IISLogAnalyzer:
         avg_tt_count = 0
         max_tt = 0.0
         avg_tt_by_hour = pd.Series(dtype='float')
-        top_ips = pd.Series(dtype='int')
-        top_uris = pd.Series(dtype='int')
+        tt_sum_by_hour = pd.Series(dtype='float')    # time taken summed per hour, over all chunks
+        tt_count_by_hour = pd.Series(dtype='float')  # requests counted per hour, over all chunks
 
         total_files = len(file_paths)
         current_file = 0
@@ -353,7 +366,7 @@ class IISLogAnalyzer:
                 # 2) requests by method
                 if 'cs-method' in chunk.columns:
                     method_counts = chunk['cs-method'].value_counts(dropna=False)
-                    requests_by_method = requests_by_method.add(method_counts, fill_value=0)
+                    method_counts_by_chunk.append(method_counts)
                     self.logger.debug(f"Aggregated methods: {method_counts.to_dict()}")
                     if progress_callback:
                         progress_callback(f"Aggregated methods in chunk: {method_counts.to_dict()}")
@@ -361,7 +374,7 @@ class IISLogAnalyzer:
                 # 3) requests by status
                 if 'sc-status' in chunk.columns:
                     status_counts = chunk['sc-status'].value_counts(dropna=False)
-                    requests_by_status = requests_by_status.add(status_counts, fill_value=0)
+                    status_counts_by_chunk.append(status_counts)
                     self.logger.debug(f"Aggregated statuses: {status_counts.to_dict()}")
                     if progress_callback:
                         progress_callback(f"Aggregated statuses in chunk: {status_counts.to_dict()}")
@@ -369,34 +382,37 @@ class IISLogAnalyzer:
                 # 4) slow requests
                 if 'time_taken_ms' in chunk.columns:
                     # Use user-provided threshold rather than hardcoded 5000
-                    slow_requests = chunk[chunk['time_taken_ms'] > slow_threshold]
-                    slow_requests_count += len(slow_requests)
+                    # (slow rows are located by position; NaN is never slow)
+                    tt = chunk['time_taken_ms'].to_numpy()
+                    slow_pos = np.flatnonzero(tt > slow_threshold)
+                    slow_tt = tt[slow_pos]
+                    slow_requests_count += len(slow_pos)
                     self.logger.debug(
-                        f"Found {len(slow_requests)} slow requests in current chunk "
+                        f"Found {len(slow_pos)} slow requests in current chunk "
                         f"(threshold={slow_threshold}ms)."
                     )
                     if progress_callback:
-                        progress_callback(f"Found {len(slow_requests)} slow requests in chunk.")
+                        progress_callback(f"Found {len(slow_pos)} slow requests in chunk.")
 
-                    # Update top 10 slowest
-                    top_slowest_requests = pd.concat([top_slowest_requests, slow_requests])
+                    # Update top 10 slowest (only this chunk's own 10 slowest rows are copied out)
+                    chunk_top_pos = slow_pos[pd.Series(slow_tt).nlargest(10).index.to_numpy()]
+                    top_slowest_requests = pd.concat([top_slowest_requests, chunk.iloc[chunk_top_pos]])
                     top_slowest_requests = top_slowest_requests.nlargest(10, 'time_taken_ms')
 
                     # Aggregate average + max time
-                    avg_tt_sum += slow_requests['time_taken_ms'].sum()
-                    avg_tt_count += slow_requests['time_taken_ms'].count()
-                    current_max_tt = slow_requests['time_taken_ms'].max()
+                    avg_tt_sum += slow_tt.sum()
+                    avg_tt_count += len(slow_tt)
+                    current_max_tt = slow_tt.max() if len(slow_tt) else np.nan
                     if pd.notna(current_max_tt) and current_max_tt > max_tt:
                         max_tt = current_max_tt
                         if progress_callback:
                             progress_callback(f"Updated maximum time taken to {max_tt} ms.")
 
-                # 5) 4xx & 5xx errors
+                # 5) 4xx & 5xx errors (read off the status counts from step 3)
                 if 'sc-status' in chunk.columns:
-                    df_4xx = chunk[(chunk['sc-status'] >= 400) & (chunk['sc-status'] < 500)]
-                    df_5xx = chunk[chunk['sc-status'] >= 500]
-                    df_4xx_count += len(df_4xx)
-                    df_5xx_count += len(df_5xx)
+                    codes = status_counts.index.to_numpy()
+                    df_4xx_count += int(status_counts[(codes >= 400) & (codes < 500)].sum())
+                    df_5xx_count += int(status_counts[codes >= 500].sum())
                     self.logger.debug(f"Aggregated 4xx: {df_4xx_count}, 5xx: {df_5xx_count}")
                     if progress_callback:
                         progress_callback(
@@ -408,11 +424,11 @@ class IISLogAnalyzer:
                     # drop rows where datetime or time_taken_ms is NaN
                     chunk = chunk.dropna(subset=['datetime', 'time_taken_ms'])
                     if not chunk.empty:
-                        chunk.set_index('datetime', inplace=True)
-                        # resample hourly
-                        avg_tt_hour = chunk['time_taken_ms'].resample('h').mean().round().astype(int).rename("AvgTTbyHour (ms)")
-                        # add to global aggregator
-                        avg_tt_by_hour = avg_tt_by_hour.add(avg_tt_hour, fill_value=0)
+                        # sum and count per hour (hours without requests are left out);
+                        # the average is taken once all chunks are in
+                        hour_stats = chunk.groupby(chunk['datetime'].dt.floor('h'))['time_taken_ms'].agg(['sum', 'count'])
+                        tt_sum_by_hour = tt_sum_by_hour.add(hour_stats['sum'], fill_value=0)
+                        tt_count_by_hour = tt_count_by_hour.add(hour_stats['count'], fill_value=0)
                         self.logger.debug("Aggregated average Time Taken by hour.")
                         if progress_callback:
                             progress_callback("Aggregated average Time Taken by hour.")
@@ -420,7 +436,7 @@ class IISLogAnalyzer:
                 # 7) top IPs
                 if 'c-ip' in chunk.columns:
                     ip_counts = chunk['c-ip'].value_counts()
-                    top_ips = top_ips.add(ip_counts, fill_value=0)
+                    ip_counts_by_chunk.append(ip_counts)
                     self.logger.debug("Aggregated Top IPs.")
                     if progress_callback:
                         progress_callback("Aggregated Top IPs.")
@@ -428,7 +444,7 @@ class IISLogAnalyzer:
                 # 8) top URIs
                 if 'cs-uri-stem' in chunk.columns:
                     uri_counts = chunk['cs-uri-stem'].value_counts()
-                    top_uris = top_uris.add(uri_counts, fill_value=0)
+                    uri_counts_by_chunk.append(uri_counts)
                     self.logger.debug("Aggregated Top URIs.")
                     if progress_callback:
                         progress_callback("Aggregated Top URIs.")
@@ -440,6 +456,11 @@ class IISLogAnalyzer:
                 progress_callback("Analysis was interrupted before finalizing.")
             return None
 
+        requests_by_method = _sum_value_counts(method_counts_by_chunk)
+        requests_by_status = _sum_value_counts(status_counts_by_chunk)
+        top_ips = _sum_value_counts(ip_counts_by_chunk)
+        top_uris = _sum_value_counts(uri_counts_by_chunk)
+
         # If we somehow didn't load any data
         if not any([total_requests, len(requests_by_method), len(requests_by_status)]):
             msg = "No valid data loaded from the selected files."
@@ -465,6 +486,10 @@ class IISLogAnalyzer:
         # Calculate overall average time taken among slow requests
         avg_tt = avg_tt_sum / avg_tt_count if avg_tt_count > 0 else None
 
+        # Average time taken per hour, weighted by the requests in every chunk and file
+        if not tt_count_by_hour.empty:
+            avg_tt_by_hour = (tt_sum_by_hour / tt_count_by_hour).round().astype(int).rename("AvgTTbyHour (ms)")
+
         # Actually write the final analysis to Excel
         return self.perform_analysis(
             log_identifier=log_identifier,
@@ -3,12 +3,13 @@
 import os
 import logging
 import sqlite3
+from contextlib import closing
 from evtx import PyEvtxParser
 from PyQt5.QtCore import QObject, pyqtSignal, QRunnable, pyqtSlot
 from evtx import PyEvtxParser  # type: ignore
 
 from services.sql_workers.db_managers.EVTX.db_manager_evtx import EVTXDatabaseManager
-from data.log_parsers.EVTX.log_parsers_evtx import parse_evtx_record_xml
+from data.log_parsers.EVTX.log_parsers_evtx import parse_evtx_records
 
 
 class TimestampLoaderSignals(QObject):
@@ -87,36 +88,29 @@ class EVTXInsertWorker(QRunnable):
             batch = []
             processed = 0
 
-            for record in parser.records():
-                if self.is_interrupted:
-                    self.logger.info("Parsing canceled by user.")
-                    self.signals.error.emit("Parsing canceled by user.")
-                    db_manager.rollback_transaction()
-                    return
-
-                try:
-                    xml = record["data"]
-                    event = parse_evtx_record_xml(xml)
-                    if event:
-                        # Remove raw_xml if you don't want it
-                        if "raw_xml" in event:
-                            del event["raw_xml"]
-                        batch.append(event)
-                        processed += 1
-                except Exception as e:
-                    self.logger.error(f"Error parsing record {processed+1}: {e}")
-                    continue
-
-                if len(batch) >= batch_size:
-                    db_manager.insert_evtx_logs(batch, self.table_name, commit=False)
-                    batch.clear()
-
-                    # Progress
-                    if total_records_estimated:
-                        pct = int(processed / total_records_estimated * 100)
-                        self.signals.progress.emit(pct)
-                    else:
-                        self.signals.progress.emit(processed)
+            # Records are parsed in a process pool; raw_xml is not stored, so it is
+            # not sent back with each event. closing() stops the pool on cancel.
+            with closing(parse_evtx_records(parser.records(), keep_raw_xml=False)) as event_batches:
+                for events in event_batches:
+                    if self.is_interrupted:
+                        self.logger.info("Parsing canceled by user.")
+                        self.signals.error.emit("Parsing canceled by user.")
+                        db_manager.rollback_transaction()
+                        return
+
+                    batch.extend(events)
+                    processed += len(events)
+
+                    if len(batch) >= batch_size:
+                        db_manager.insert_evtx_logs(batch, self.table_name, commit=False)
+                        batch.clear()
+
+                        # Progress
+                        if total_records_estimated:
+                            pct = int(processed / total_records_estimated * 100)
+                            self.signals.progress.emit(pct)
+                        else:
+                            self.signals.progress.emit(processed)
 
             # leftover batch
             if batch:
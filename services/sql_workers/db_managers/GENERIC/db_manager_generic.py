@@ -284,7 +284,7 @@ class GenericDBManager:
     def insert_logs_batch(self, rows):
         """
         Insert a batch of raw logs into generic_logs.
-        Each row must have:
+        Each row is a LogRow (see msg_parser) with:
           - combined_ts (float or None)
           - log_level
           - raw_line
@@ -299,15 +299,15 @@ class GenericDBManager:
 
             data_batch = []
             for r in rows:
-                trans_str = r.get('trans_ids', [])
+                trans_str = r.trans_ids
                 if isinstance(trans_str, list):
                     trans_str = ",".join(trans_str)
                 data_batch.append((
-                    r.get('combined_ts', None),
-                    r.get('log_level', None),
-                    r.get('raw_line',''),
+                    r.combined_ts,
+                    r.log_level,
+                    r.raw_line,
                     trans_str,
-                    r.get('source_file','')
+                    r.source_file or ''
                 ))
 
             cur.executemany("""
@@ -330,6 +330,8 @@ class GenericDBManager:
           - promotions
           - promo_items correlation
           - loyalty data (balances, accounts, members, segments, cards, stores)
+        'tx_data' is a msg_parser Transaction or a prom_parser PromTransaction; both are read
+        through ['trans_id'] / .get().
         """
         trans_id = tx_data['trans_id']
 
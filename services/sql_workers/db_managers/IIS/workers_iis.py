@@ -5,7 +5,7 @@ import logging
 from PyQt5.QtCore import QObject, pyqtSignal, QRunnable, pyqtSlot  # pylint: disable=no-name-in-module
 import os
 import time
-from data.log_parsers.IIS.log_parsers_iis import parse_iis_log_generator  # Ensure correct import path
+from data.log_parsers.IIS.log_parsers_iis import parse_iis_log_batches, IIS_READ_BUFFER_SIZE  # Ensure correct import path
 from services.sql_workers.db_managers.IIS.db_manager_iis import DatabaseManager  # Ensure correct import path
 
 logger = logging.getLogger('IISLogToSQLiteWorker')  # pylint: disable=no-member
@@ -80,47 +80,48 @@ class IISLogToSQLiteWorker(QRunnable):
                 total_file_size += file_size_mb
                 self.logger.debug(f"Processing file: {file} ({file_size_mb:.2f} MB)")
 
-                with open(file, "r", encoding="utf-8", errors="replace") as f:
-                    parser = parse_iis_log_generator(f)
+                with open(file, "r", encoding="utf-8", errors="replace", buffering=IIS_READ_BUFFER_SIZE) as f:
+                    parser = parse_iis_log_batches(f)
                     last_emitted_pct = 0  # For progress reporting
 
-                    for row_dict in parser:
+                    for rows in parser:
                         if self.is_cancelled:
                             self.logger.info("Parsing cancelled by user.")
                             self.signals.error.emit("Parsing was cancelled by user.")
                             return
 
-                        # Only process rows with a valid timestamp
-                        if row_dict.get("combined_ts") is not None:
-                            # Build the record to insert (same as before)
-                            record = {
-                                'date': row_dict.get('date', '-'),
-                                'time': row_dict.get('time', '-'),
-                                's_ip': row_dict.get('s_ip', '-'),
-                                'cs_method': row_dict.get('cs_method', '-'),
-                                'cs_uri_stem': row_dict.get('cs_uri_stem', '-'),
-                                'cs_uri_query': row_dict.get('cs_uri_query', '-'),
-                                's_port': row_dict.get('s_port', '-'),
-                                'cs_username': row_dict.get('cs_username', '-'),
-                                'c_ip': row_dict.get('c_ip', '-'),
-                                'cs_User_Agent': row_dict.get('cs_User_Agent', '-'),
-                                'cs_Referer': row_dict.get('cs_Referer', '-'),
-                                'sc_status': row_dict.get('sc_status', '-'),
-                                'sc_substatus': row_dict.get('sc_substatus', '-'),
-                                'sc_win32_status': row_dict.get('sc_win32_status', '-'),
-                                'time_taken': row_dict.get('time_taken', '-'),
-                                'ns_client_ip': row_dict.get('ns_client_ip', '-'),
-                                'combined_ts': row_dict.get('combined_ts', None),
-                                'raw_line': row_dict.get('raw_line', '')
-                            }
-                            batch_data.append(record)
-
-                            ts = row_dict.get("combined_ts")
-                            if ts:
-                                overall_min_ts = ts if overall_min_ts is None or ts < overall_min_ts else overall_min_ts
-                                overall_max_ts = ts if overall_max_ts is None or ts > overall_max_ts else overall_max_ts
-
-                        processed_lines += 1
+                        for row_dict in rows:
+                            # Only process rows with a valid timestamp
+                            if row_dict.get("combined_ts") is not None:
+                                # Build the record to insert (same as before)
+                                record = {
+                                    'date': row_dict.get('date', '-'),
+                                    'time': row_dict.get('time', '-'),
+                                    's_ip': row_dict.get('s_ip', '-'),
+                                    'cs_method': row_dict.get('cs_method', '-'),
+                                    'cs_uri_stem': row_dict.get('cs_uri_stem', '-'),
+                                    'cs_uri_query': row_dict.get('cs_uri_query', '-'),
+                                    's_port': row_dict.get('s_port', '-'),
+                                    'cs_username': row_dict.get('cs_username', '-'),
+                                    'c_ip': row_dict.get('c_ip', '-'),
+                                    'cs_User_Agent': row_dict.get('cs_User_Agent', '-'),
+                                    'cs_Referer': row_dict.get('cs_Referer', '-'),
+                                    'sc_status': row_dict.get('sc_status', '-'),
+                                    'sc_substatus': row_dict.get('sc_substatus', '-'),
+                                    'sc_win32_status': row_dict.get('sc_win32_status', '-'),
+                                    'time_taken': row_dict.get('time_taken', '-'),
+                                    'ns_client_ip': row_dict.get('ns_client_ip', '-'),
+                                    'combined_ts': row_dict.get('combined_ts', None),
+                                    'raw_line': row_dict.get('raw_line', '')
+                                }
+                                batch_data.append(record)
+
+                                ts = row_dict.get("combined_ts")
+                                if ts:
+                                    overall_min_ts = ts if overall_min_ts is None or ts < overall_min_ts else overall_min_ts
+                                    overall_max_ts = ts if overall_max_ts is None or ts > overall_max_ts else overall_max_ts
+
+                        processed_lines += len(rows)
 
                         # Report progress based on file position
                         current_pos = f.buffer.tell()  # byte position